@@ -1,19 +1,30 @@
 from aiogram import Router, types, F, Bot
+from aiogram.types import FSInputFile
 from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from db import (
-    is_admin, is_staff, set_chat_active, get_all_chats, log, get_new_tickets, get_admins,
-    add_support_chat, is_ticket_published, register_publication, get_ticket, get_ticket_media, get_all_tickets,
-    get_user_by_id, set_user_role
+    is_admin, is_staff, set_chat_active, get_all_chats, get_active_support_chats, log, get_admins,
+    add_support_chat, get_unpublished_new_tickets, get_ticket, get_ticket_media,
+    get_user_by_id, get_user_role, set_user_role, get_archived_ticket, get_chat_tags, set_chat_tags
 )
-from handlers import gen_accept_kb
+from aiogram.exceptions import TelegramBadRequest
+from config import REPUBLISH_PROGRESS_INTERVAL, EXPORT_MAX_FILE_MB
+from publisher import publish_ticket, publish_many, author_link
+from history import history_page, parse_history_callback, search_page, search_query, ticket_card
+from stats import stats_text
+from export import export_running, parse_export_args, export_filename, export_to_file
+from routing import ticket_router, parse_tags
+import functools
 import logging
+import os
+import time
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 # ---- Декораторы ----
 def staff_or_admin_only(handler):
+    @functools.wraps(handler)
     async def wrapper(*args, **kwargs):
         obj = None
         for arg in args:
@@ -24,9 +35,7 @@ def staff_or_admin_only(handler):
         if obj is None:
             logger.error("staff_or_admin_only: не найден message/callback")
             return
-        user_id = obj.from_user.id
-        user = await get_user_by_id(user_id)
-        role = user[3] if user else None
+        role = await get_user_role(obj.from_user.id)
         if role not in ('admin', 'staff'):
             await obj.answer("Доступ только для staff или admin.") if hasattr(obj, "answer") else await obj.message.answer("Доступ только для staff или admin.")
             return
@@ -34,6 +43,7 @@ def staff_or_admin_only(handler):
     return wrapper
 
 def admin_only(handler):
+    @functools.wraps(handler)
     async def wrapper(*args, **kwargs):
         obj = None
         for arg in args:
@@ -70,6 +80,30 @@ async def show_chats(message: types.Message, **kwargs):
             kb.button(text=f"Активировать {title or chat_id}", callback_data=f"activate_{chat_id}")
     await message.answer(text, reply_markup=kb.as_markup())
 
+@router.message(Command("chat_tags"))
+@admin_only
+async def chat_tags(message: types.Message, **kwargs):
+    parts = message.text.split(maxsplit=2)
+    if len(parts) < 2:
+        rows = await get_chat_tags()
+        text = "\n".join(f"{chat_id}: {tags}" for chat_id, tags in rows) or "Тегов у чатов нет."
+        await message.answer(
+            f"{text}\n\nИспользование: /chat_tags &lt;chat_id&gt; [теги через пробел] — без тегов очищает."
+        )
+        return
+    try:
+        chat_id = int(parts[1])
+    except ValueError:
+        await message.answer("chat_id должен быть числом.")
+        return
+    tags = parse_tags(parts[2] if len(parts) > 2 else "")
+    if not await set_chat_tags(chat_id, " ".join(tags)):
+        await message.answer(f"Чат {chat_id} не найден.")
+        return
+    ticket_router.set_tags(chat_id, tags)
+    await log("chat_tags", message.from_user.id, f"Теги чата {chat_id}: {' '.join(tags) or '—'}")
+    await message.answer(f"Теги чата {chat_id}: {' '.join(tags) or 'нет'}.")
+
 @router.callback_query(F.data.startswith("activate_"))
 @admin_only
 async def activate_chat(callback: types.CallbackQuery, **kwargs):
@@ -124,49 +158,127 @@ async def decline_chat(callback: types.CallbackQuery, **kwargs):
 async def republish_new_tickets(message: types.Message, bot: Bot = None, **kwargs):
     if not bot:
         bot = kwargs.get('bot')
-    tickets = await get_new_tickets()
-    chats = await get_all_chats()
-    count = 0
-    for ticket in tickets:
-        for chat_id, title, is_active in chats:
-            if is_active and not await is_ticket_published(ticket[0], chat_id):
-                media = await get_ticket_media(ticket[0])
-                group = []
-                for m in media:
-                    if m[0] == 'photo':
-                        group.append(types.InputMediaPhoto(m[1], caption=ticket[3] if len(group) == 0 else None))
-                    elif m[0] == 'video':
-                        group.append(types.InputMediaVideo(m[1], caption=ticket[3] if len(group) == 0 else None))
-                if group:
-                    msgs = await bot.send_media_group(chat_id=chat_id, media=group)
-                    await register_publication(ticket[0], chat_id, msgs[0].message_id)
-                else:
-                    msg = await bot.send_message(chat_id, ticket[3], reply_markup=gen_accept_kb(ticket[0]))
-                    await register_publication(ticket[0], chat_id, msg.message_id)
-                count += 1
-    await message.answer(f"Опубликовано новых заявок: {count}")
+    tickets = await get_unpublished_new_tickets()
+    if not tickets:
+        await message.answer("Опубликовано новых заявок: 0")
+        return
+    jobs = [
+        (ticket_id, text, author_link(user_id, username), media, chat_ids)
+        for ticket_id, user_id, username, text, media, chat_ids in tickets
+    ]
+    status = await message.answer(f"Републикация: 0/{sum(len(job[4]) for job in jobs)}")
+    last_edit = time.monotonic()
+
+    async def on_progress(done, total):
+        # Одно статус-сообщение, правим не чаще раза в несколько секунд
+        nonlocal last_edit
+        if time.monotonic() - last_edit >= REPUBLISH_PROGRESS_INTERVAL and done < total:
+            last_edit = time.monotonic()
+            try:
+                await status.edit_text(f"Републикация: {done}/{total}")
+            except TelegramBadRequest as e:
+                logger.warning(f"edit_text failed: {e}")
+
+    count = await publish_many(bot, jobs, on_progress=on_progress)
+    await status.edit_text(f"Опубликовано новых заявок: {count}")
 
 @router.message(Command("all_history"))
 @admin_only
 async def all_history(message: types.Message, **kwargs):
-    tickets = await get_all_tickets()
-    if not tickets:
+    text, kb = await history_page("all")
+    if not text:
         await message.answer("Заявок не найдено.")
         return
-    text_lines = []
-    for t in tickets:
-        ticket_id, user_id, username, created_at, status, text = t
-        snippet = (text[:50] + "...") if text and len(text) > 50 else (text or "")
-        text_lines.append(f"#{ticket_id} [{status}] {created_at} — @{username or user_id}: {snippet}")
-    MAX_CHARS = 4000
-    msg = ""
-    for line in text_lines:
-        if len(msg) + len(line) + 1 > MAX_CHARS:
-            await message.answer(msg)
-            msg = ""
-        msg += line + "\n"
-    if msg:
-        await message.answer(msg)
+    await message.answer(text, reply_markup=kb)
+
+@router.callback_query(F.data.startswith("hist:all:"))
+@admin_only
+async def all_history_page(callback: types.CallbackQuery, **kwargs):
+    scope, direction, cursor = parse_history_callback(callback.data)
+    text, kb = await history_page(scope, direction, cursor)
+    if text:
+        await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
+
+@router.message(Command("search"))
+@admin_only
+async def search(message: types.Message, **kwargs):
+    query = search_query(message.text)
+    if not query:
+        await message.answer("Используй: /search &lt;слова из заявки или username&gt;")
+        return
+    text, kb = await search_page(query)
+    if not text:
+        await message.answer("Ничего не найдено.")
+        return
+    # Ответом на команду: при листании запрос берётся из reply_to_message
+    await message.reply(text, reply_markup=kb)
+
+@router.callback_query(F.data.startswith("srch:"))
+@admin_only
+async def search_results_page(callback: types.CallbackQuery, **kwargs):
+    source = callback.message.reply_to_message
+    query = search_query(source.text if source else "")
+    if not query:
+        await callback.answer("Запрос не найден, повторите /search.", show_alert=True)
+        return
+    text, kb = await search_page(query, int(callback.data.split(":")[1]))
+    if text:
+        await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
+
+@router.message(Command("ticket"))
+@admin_only
+async def ticket(message: types.Message, **kwargs):
+    cmd_text = message.text.strip().split()
+    if len(cmd_text) < 2 or not cmd_text[1].lstrip("#").isdigit():
+        await message.answer("Используй: /ticket &lt;id_заявки&gt;")
+        return
+    ticket_id = int(cmd_text[1].lstrip("#"))
+    text = await ticket_card(ticket_id)
+    await message.answer(text or f"Заявка #{ticket_id} не найдена.")
+
+@router.message(Command("stats"))
+@admin_only
+async def stats(message: types.Message, **kwargs):
+    await message.answer(await stats_text())
+
+@router.message(Command("export"))
+@admin_only
+async def export(message: types.Message, **kwargs):
+    options, error = parse_export_args(message.text)
+    if error:
+        await message.answer(error)
+        return
+    if export_running():
+        await message.answer("Выгрузка уже идёт, дождись её окончания.")
+        return
+    status_msg = await message.answer("⏳ Готовлю выгрузку...")
+    try:
+        path, total = await export_to_file(**options)
+    except Exception as e:
+        logger.error(f"export error: {e}")
+        await status_msg.edit_text("❌ Выгрузка не удалась, подробности в логе бота.")
+        return
+    try:
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        if size_mb > EXPORT_MAX_FILE_MB:
+            await status_msg.edit_text(
+                f"Файл получился {size_mb:.0f} МБ — больше {EXPORT_MAX_FILE_MB} МБ. Сузь период через from=/to=."
+            )
+            return
+        await message.answer_document(
+            FSInputFile(path, filename=export_filename(options)),
+            caption=f"Строк: {total}"
+        )
+        await status_msg.delete()
+    except Exception as e:
+        logger.error(f"export send error: {e}")
+        await status_msg.edit_text("❌ Не удалось отправить файл выгрузки, подробности в логе бота.")
+        return
+    finally:
+        os.remove(path)
+    await log("export", message.from_user.id, message.text)
 
 @router.message(Command("help_admins"))
 @staff_or_admin_only
@@ -191,6 +303,9 @@ async def help_admins(message: types.Message, **kwargs):
 <code>/chats</code>
 — Список всех подключённых чатов поддержки. Можно включать/выключать чаты кнопками прямо из Telegram.
 
+<code>/chat_tags &lt;chat_id&gt; [теги]</code>
+— <b>Команда для админа!</b> Теги чата поддержки для маршрутизации <code>ROUTING_STRATEGY=tags</code>: заявка уходит только в чаты, чьи теги встречаются в её тексте. Без тегов — очистить, без аргументов — список. Пример: <code>/chat_tags -1001234567890 принтер 1с</code>
+
 <code>/republish_new_tickets</code>
 — Переотправляет все новые неразмещённые заявки во все активные чаты поддержки.
 
@@ -198,7 +313,19 @@ async def help_admins(message: types.Message, **kwargs):
 — <b>Новая команда!</b> Переопубликовывает ЛЮБУЮ заявку по номеру (id) во все активные чаты поддержки, независимо от статуса и прошлых публикаций. Пример: <code>/republish_ticket 7</code>
 
 <code>/all_history</code>
-— Полная история всех заявок: номер, дата, статус, начало текста, отправитель. Если заявок много — разбивка по 4000 символов.
+— Полная история всех заявок: номер, дата, статус, начало текста, отправитель. Листается кнопками «Новее»/«Старее».
+
+<code>/search &lt;запрос&gt;</code>
+— Полнотекстовый поиск по тексту заявок и username: сначала лучшие совпадения, найденное выделено. Пример: <code>/search принтер бухгалтерия</code>
+
+<code>/ticket &lt;id&gt;</code>
+— Карточка заявки: статус, автор, кто и когда принял и закрыл, вложения, публикации и полный текст. Находит и заявки, перенесённые в архив. Пример: <code>/ticket 7</code>
+
+<code>/stats</code>
+— Сводка: сколько заявок ждут принятия и в работе, создано/принято/закрыто по дням, среднее и максимальное время до принятия и до решения.
+
+<code>/export tickets|logs [csv|jsonl] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД] [status=…]</code>
+— <b>Команда для админа!</b> Выгрузка заявок (с file_id вложений и публикациями) или журнала действий сжатым файлом .gz. Пример: <code>/export tickets jsonl from=2026-01-01 status=done</code>
 
 <code>/set_role &lt;user_id&gt; &lt;role&gt;</code>
 — <b>Команда для админа!</b> Позволяет назначить роль user/staff/admin по Telegram ID.
@@ -238,6 +365,7 @@ async def set_role(message: types.Message, **kwargs):
         await message.answer(f"Пользователь с Telegram ID {telegram_id} не найден.")
         return
     await set_user_role(int(telegram_id), role)
+    ticket_router.set_role(int(telegram_id), role)
     await message.answer(f"Роль пользователя {telegram_id} изменена на {role}.")
 
 @router.message(Command("republish_ticket"))
@@ -250,24 +378,15 @@ async def republish_ticket(message: types.Message, bot: Bot = None, **kwargs):
     ticket_id = int(cmd_text[1])
     ticket = await get_ticket(ticket_id)
     if not ticket:
-        await message.answer(f"Заявка #{ticket_id} не найдена.")
+        archived = await get_archived_ticket(ticket_id)
+        await message.answer(
+            f"Заявка #{ticket_id} в архиве, посмотреть: /ticket {ticket_id}" if archived
+            else f"Заявка #{ticket_id} не найдена."
+        )
         return
-    chats = await get_all_chats()
-    count = 0
-    for chat_id, title, is_active in chats:
-        if is_active:
-            media = await get_ticket_media(ticket_id)
-            group = []
-            for m in media:
-                if m[0] == 'photo':
-                    group.append(types.InputMediaPhoto(m[1], caption=ticket[3] if len(group) == 0 else None))
-                elif m[0] == 'video':
-                    group.append(types.InputMediaVideo(m[1], caption=ticket[3] if len(group) == 0 else None))
-            if group:
-                msgs = await bot.send_media_group(chat_id=chat_id, media=group)
-                await register_publication(ticket_id, chat_id, msgs[0].message_id)
-            else:
-                msg = await bot.send_message(chat_id, ticket[3], reply_markup=gen_accept_kb(ticket_id))
-                await register_publication(ticket_id, chat_id, msg.message_id)
-            count += 1
+    chats = await get_active_support_chats()
+    media = await get_ticket_media(ticket_id)
+    targets = [chat[0] for chat in chats]
+    failed = await publish_ticket(bot, ticket_id, ticket[3], author_link(ticket[1], ticket[2]), media, targets)
+    count = len(targets) - len(failed)
     await message.answer(f"Заявка #{ticket_id} переопубликована в {count} чат(ах).")
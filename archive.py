@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from config import (
+    ARCHIVE_AFTER_DAYS, LOGS_RETENTION_DAYS, ARCHIVE_INTERVAL, ARCHIVE_BATCH_SIZE, ARCHIVE_VACUUM_STEP
+)
+from db import archive_done_tickets, prune_logs, incremental_vacuum
+
+logger = logging.getLogger(__name__)
+
+# Пауза между пачками и шагами vacuum: пишущие хендлеры не ждут, пока архивация разберёт весь хвост
+BATCH_PAUSE = 0.05
+
+
+class Archiver:
+    """Фоновое обслуживание базы раз в interval секунд: перенос старых завершённых заявок
+    в архив, удаление старых записей журнала и возврат освободившегося места SQLite.
+
+    Всё делается пачками по batch_size строк, каждая — своей короткой транзакцией.
+    """
+
+    def __init__(self, interval: float = ARCHIVE_INTERVAL, archive_after_days: int = ARCHIVE_AFTER_DAYS,
+                 logs_retention_days: int = LOGS_RETENTION_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE,
+                 vacuum_step: int = ARCHIVE_VACUUM_STEP):
+        self.interval = interval
+        self.archive_after_days = archive_after_days
+        self.logs_retention_days = logs_retention_days
+        self.batch_size = max(1, batch_size)
+        self.vacuum_step = max(1, vacuum_step)
+        self.totals = {"runs": 0, "tickets": 0, "logs": 0, "pages": 0}
+        self._vacuum_warned = False
+        self._task = None
+
+    def stats(self) -> dict:
+        return dict(self.totals)
+
+    async def _drain(self, step, before) -> int:
+        total = 0
+        while True:
+            moved = await step(before, self.batch_size)
+            total += moved
+            if moved < self.batch_size:
+                return total
+            await asyncio.sleep(BATCH_PAUSE)
+
+    async def _vacuum(self):
+        total = 0
+        while True:
+            freed = await incremental_vacuum(self.vacuum_step)
+            if freed is None:
+                return None
+            if freed <= 0:
+                return total
+            total += freed
+            await asyncio.sleep(BATCH_PAUSE)
+
+    async def run_once(self) -> dict:
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        result = {"tickets": 0, "logs": 0, "pages": 0}
+        if self.archive_after_days:
+            result["tickets"] = await self._drain(archive_done_tickets, now - timedelta(days=self.archive_after_days))
+        if self.logs_retention_days:
+            result["logs"] = await self._drain(prune_logs, now - timedelta(days=self.logs_retention_days))
+        if result["tickets"] or result["logs"]:
+            pages = await self._vacuum()
+            if pages is None:
+                if not self._vacuum_warned:
+                    self._vacuum_warned = True
+                    logger.warning("SQLite база создана без auto_vacuum=INCREMENTAL: освободившееся место "
+                                   "переиспользуется, но файл не уменьшается (см. README, «Архивация»)")
+            else:
+                result["pages"] = pages
+        self.totals["runs"] += 1
+        for key, value in result.items():
+            self.totals[key] += value
+        if any(result.values()):
+            logger.info(f"Archiver: {result}")
+        return result
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"archiver error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None and (self.archive_after_days or self.logs_retention_days):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+archiver = Archiver()
@@ -0,0 +1,117 @@
+"""Локальная заглушка Telegram Bot API для нагрузочных прогонов.
+
+Отвечает на методы, которые вызывает бот, правдоподобными объектами и считает
+вызовы. Запуск отдельно: python -m bench.fake_telegram --port 8081
+(и TELEGRAM_API_URL=http://127.0.0.1:8081 у бота).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from aiohttp import web
+
+BOT_USER = {"id": 1000000, "is_bot": True, "first_name": "HelpdeskBot", "username": "helpdesk_bot"}
+
+
+class FakeTelegramAPI:
+    def __init__(self, latency_ms: float = 0, flood_rate: float = 0, retry_after: int = 1):
+        self.latency = latency_ms / 1000
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.flood_errors = 0
+        self._message_ids = itertools.count(1)
+        # Документы (/export) бывают больше 1 МБ по умолчанию у aiohttp
+        self.app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = None
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def _message(self, params: dict, **extra) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        msg = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+            "from": BOT_USER,
+        }
+        msg.update(extra)
+        return msg
+
+    async def _params(self, request: web.Request) -> dict:
+        # aiogram шлёт form-data (urlencoded или multipart); файлы бенчмарку не нужны
+        data = await request.post()
+        return {k: v for k, v in data.items() if isinstance(v, str)}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method.startswith("send") and self.flood_rate and random.random() < self.flood_rate:
+            self.flood_errors += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            # Трафик в бенчмарке подаётся напрямую в диспетчер; long polling просто ждёт
+            await asyncio.sleep(min(float(params.get("timeout", 0) or 0), 1))
+            result = []
+        elif method == "sendMediaGroup":
+            media = json.loads(params.get("media", "[]"))
+            result = [self._message(params, photo=[{"file_id": m.get("media", ""), "file_unique_id": "u",
+                                                      "width": 1, "height": 1}]) for m in media]
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(params, text=params.get("text", ""))
+        elif method in ("sendPhoto", "sendVideo", "sendAudio", "sendDocument", "editMessageReplyMarkup", "editMessageCaption"):
+            result = self._message(params, caption=params.get("caption", ""))
+        else:
+            # setWebhook, deleteWebhook, answerCallbackQuery и прочее
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+async def _serve(args):
+    api = FakeTelegramAPI(args.latency_ms, args.flood_rate)
+    url = await api.start(args.host, args.port)
+    print(f"Fake Telegram Bot API on {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--flood-rate", type=float, default=0, help="доля send*-запросов, отвечающих 429")
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -1,17 +1,39 @@
 import asyncio
 import logging
 import os
+import signal
+from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-from config import BOT_TOKEN
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from config import (
+    BOT_TOKEN, STORAGE_BACKEND, DATABASE_PATH, CHATS_REFRESH_INTERVAL, BOT_MODE, DROP_PENDING_UPDATES, UPDATES_CONCURRENCY,
+    TELEGRAM_API_URL, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    METRICS_HOST, METRICS_PORT, TELEGRAM_GLOBAL_RATE, TELEGRAM_GROUP_PER_MINUTE, TELEGRAM_PRIVATE_RATE
+)
 from handlers import router as h_router
 from commands import router as c_router
 from admin import router as a_router
 from fallback import router as f_router
-from db import init_db
+from db import init_db, open_pool, close_pool, log_writer, pool_stats, role_cache, load_active_chats
+from publish_queue import PublishQueue
+from status_sync import StatusSync
+from ticket_merge import TicketMerger
+from archive import archiver
+from routing import ticket_router
+from sla import sla_scheduler
+from middlewares import (
+    AlbumMiddleware, ThrottleMiddleware, ConcurrencyLimitMiddleware,
+    UpdateMetricsMiddleware, HandlerMetricsMiddleware, RequestMetricsMiddleware, RateLimitMiddleware
+)
+from ratelimit import ChatRateLimiter
+import metrics
 
 # Автоматически создаём директорию data для sqlite, если не существует
-os.makedirs("/app/data", exist_ok=True)
+if STORAGE_BACKEND == "sqlite":
+    os.makedirs(os.path.dirname(DATABASE_PATH) or ".", exist_ok=True)
 
 # Настройка логирования (будет видно в docker compose logs)
 logging.basicConfig(
@@ -20,23 +42,164 @@ logging.basicConfig(
 )
 logger = logging.getLogger("main")
 
-async def main():
-    logger.info("Init DB")
-    await init_db()
-    logger.info("Starting bot")
+# Лимиты Telegram считаются на бота — один limiter на процесс
+api_limiter = RateLimitMiddleware(ChatRateLimiter(
+    global_rate=TELEGRAM_GLOBAL_RATE, group_per_minute=TELEGRAM_GROUP_PER_MINUTE, private_rate=TELEGRAM_PRIVATE_RATE
+))
+
+def create_bot() -> Bot:
+    # TELEGRAM_API_URL — свой Bot API сервер (локальный telegram-bot-api или фейк для тестов)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    # Первым зарегистрирован — внешний: метрики видят каждую попытку отдельно
+    bot.session.middleware(api_limiter)
+    bot.session.middleware(RequestMetricsMiddleware())
+    return bot
 
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+def create_dispatcher(bot: Bot) -> Dispatcher:
     dp = Dispatcher()
+    dp["publish_queue"] = PublishQueue(bot)
+    dp["ticket_merger"] = TicketMerger(dp["publish_queue"])
+    dp["status_sync"] = StatusSync(bot)
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    # Inner-middleware диспетчера наследуются всеми подключёнными роутерами
+    for observer in (dp.message, dp.callback_query, dp.my_chat_member):
+        observer.middleware(HandlerMetricsMiddleware())
+    # Альбомы приходят отдельными апдейтами — склеиваем их до хендлеров
+    dp.message.outer_middleware(AlbumMiddleware())
+    # Флуд одного пользователя отсекается до хендлеров (после склейки: альбом — одно сообщение)
+    dp["throttle"] = ThrottleMiddleware()
+    dp.message.outer_middleware(dp["throttle"])
+    # Сколько апдейтов обрабатывается одновременно — одинаково для polling и webhook.
+    # Для сообщений — после склейки: части альбома, пока он собирается, слот не занимают
+    limit = ConcurrencyLimitMiddleware(UPDATES_CONCURRENCY)
+    for observer in (dp.message, dp.callback_query, dp.my_chat_member):
+        observer.outer_middleware(limit)
 
     # Подключение всех роутеров (сохраняется приоритет)
     dp.include_router(c_router)
     dp.include_router(a_router)
     dp.include_router(h_router)
     dp.include_router(f_router)
+    return dp
+
+def register_gauges(dp: Dispatcher):
+    publish_queue = dp["publish_queue"]
+    metrics.register(metrics.Gauge(
+        "helpdesk_publish_queue_depth", "Tickets waiting for publication", publish_queue.qsize))
+    metrics.register(metrics.Gauge(
+        "helpdesk_status_sync_depth", "Tickets waiting for status sync", dp["status_sync"].qsize))
+    metrics.register(metrics.Gauge(
+        "helpdesk_log_buffer_depth", "Audit records waiting for flush", log_writer.qsize))
+    metrics.register(metrics.Gauge(
+        "helpdesk_db_pool", "DB connection pool state", pool_stats, ("state",)))
+    metrics.register(metrics.Gauge(
+        "helpdesk_role_cache", "Role cache counters", role_cache.stats, ("counter",)))
+    metrics.register(metrics.Gauge(
+        "helpdesk_telegram_limiter", "Bot API rate limiter counters", api_limiter.stats, ("counter",)))
+    metrics.register(metrics.Gauge(
+        "helpdesk_inbound_throttle", "Inbound messages passed and dropped by flood control",
+        dp["throttle"].stats, ("counter",)))
+    metrics.register(metrics.Gauge(
+        "helpdesk_ticket_merger", "Tickets held in the merge window and messages merged",
+        dp["ticket_merger"].stats, ("counter",)))
+    metrics.register(metrics.Gauge(
+        "helpdesk_routing", "Staff available for assignment and their accepted tickets",
+        ticket_router.stats, ("counter",)))
+    metrics.register(metrics.Gauge(
+        "helpdesk_sla", "Open SLA timers, reminders sent and escalations since start",
+        sla_scheduler.stats, ("counter",)))
+    metrics.register(metrics.Gauge(
+        "helpdesk_archiver", "Archived tickets, pruned logs and freed pages since start", archiver.stats, ("counter",)))
+
+async def refresh_chats_periodically(interval: float):
+    # Чаты, одобренные через другой экземпляр бота, подхватываются без рестарта
+    while True:
+        await asyncio.sleep(interval)
+        await load_active_chats()
+        # Нагрузку меняют и другие экземпляры — счётчики в памяти сверяются с БД
+        await ticket_router.load()
+
+async def run_polling(bot: Bot, dp: Dispatcher):
+    await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+    logger.info("Helpdesk Bot is running (polling).")
+    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    logger.info("Helpdesk Bot is running.")
-    await dp.start_polling(bot)
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    try:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            drop_pending_updates=DROP_PENDING_UPDATES,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info(f"Helpdesk Bot is running (webhook on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}).")
+        # Как start_polling: SIGTERM (docker stop) / SIGINT завершают ожидание, и main()
+        # успевает остановить очереди и сбросить журнал
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        try:
+            await stop.wait()
+        finally:
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(sig)
+        logger.info("Stopping webhook server")
+    finally:
+        await runner.cleanup()
+
+async def main():
+    logger.info("Init DB")
+    await open_pool()
+    await init_db()
+    await ticket_router.load()
+    logger.info("Starting bot")
+
+    bot = create_bot()
+    dp = create_dispatcher(bot)
+    publish_queue = dp["publish_queue"]
+    status_sync = dp["status_sync"]
+    ticket_merger = dp["ticket_merger"]
+    metrics_runner = None
+    refresh_task = None
+
+    try:
+        if METRICS_PORT:
+            register_gauges(dp)
+            metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+        log_writer.start()
+        await publish_queue.start()
+        status_sync.start()
+        archiver.start()
+        await sla_scheduler.start(bot)
+        if CHATS_REFRESH_INTERVAL:
+            refresh_task = asyncio.create_task(refresh_chats_periodically(CHATS_REFRESH_INTERVAL))
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await run_polling(bot, dp)
+    finally:
+        if refresh_task:
+            refresh_task.cancel()
+        await sla_scheduler.stop()
+        await ticket_merger.stop()
+        await publish_queue.stop()
+        await status_sync.stop()
+        await archiver.stop()
+        await log_writer.stop()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await bot.session.close()
+        await close_pool()
 
 if __name__ == "__main__":
     try:
@@ -1,6 +1,7 @@
-from aiogram import Router, types
+from aiogram import Router, types, F
 from aiogram.filters import Command, CommandStart
-from db import get_user_by_id, get_user_tickets, add_or_update_user
+from db import get_user_by_id, add_or_update_user
+from history import history_page, parse_history_callback
 import logging
 
 router = Router()
@@ -47,22 +48,17 @@ async def cmd_who_am_i(message: types.Message):
 
 @router.message(Command("my_history"))
 async def cmd_my_history(message: types.Message):
-    tickets = await get_user_tickets(message.from_user.id)
-    if not tickets:
+    text, kb = await history_page("my", user_id=message.from_user.id)
+    if not text:
         await message.answer("У вас пока нет заявок.")
         return
-    text_lines = []
-    for t in tickets:
-        ticket_id, created_at, status, text = t
-        snippet = (text[:50] + "...") if text and len(text) > 50 else (text or "")
-        text_lines.append(f"#{ticket_id} [{status}] — {snippet}")
-    # Режем на сообщения до 4000 символов (ограничение Telegram)
-    MAX_CHARS = 4000
-    msg = ""
-    for line in text_lines:
-        if len(msg) + len(line) + 1 > MAX_CHARS:
-            await message.answer(msg)
-            msg = ""
-        msg += line + "\n"
-    if msg:
-        await message.answer(msg)
+    await message.answer(text, reply_markup=kb)
+
+@router.callback_query(F.data.startswith("hist:my:"))
+async def my_history_page(callback: types.CallbackQuery):
+    scope, direction, cursor = parse_history_callback(callback.data)
+    # Только свои заявки: фильтр по тому, кто нажал кнопку
+    text, kb = await history_page(scope, direction, cursor, user_id=callback.from_user.id)
+    if text:
+        await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
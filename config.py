@@ -1,4 +1,5 @@
 import os
+import re
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,6 +13,134 @@ ADMIN_USER_IDS = [
 ]
 
 # Абсолютный путь внутри контейнера (volume ./data:/app/data)
-DATABASE_PATH = "/app/data/helpdesk.sqlite3"
+DATABASE_PATH = os.getenv("DATABASE_PATH", "/app/data/helpdesk.sqlite3")
+
+# Хранилище: sqlite (один файл DATABASE_PATH, один процесс) или postgres (DATABASE_URL,
+# несколько экземпляров бота на одной базе)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").lower()
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+if STORAGE_BACKEND == "postgres" and not DATABASE_URL:
+    raise RuntimeError("DATABASE_URL must be set when STORAGE_BACKEND=postgres!")
+# Как часто перечитывать список активных чатов, с; 0 — только при изменениях
+# из этого процесса (достаточно для одного экземпляра)
+CHATS_REFRESH_INTERVAL = float(os.getenv("CHATS_REFRESH_INTERVAL", "0"))
+
+# Пул соединений к БД
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Архивация: завершённые заявки старше ARCHIVE_AFTER_DAYS дней вместе с вложениями и
+# публикациями переносятся в ARCHIVE_DATABASE_PATH (для postgres — в таблицы *_archive);
+# 0 (по умолчанию) — не архивировать
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_DATABASE_PATH = os.getenv("ARCHIVE_DATABASE_PATH", os.path.splitext(DATABASE_PATH)[0] + "-archive.sqlite3")
+# Сколько дней хранить журнал действий (logs); 0 (по умолчанию) — хранить всё
+LOGS_RETENTION_DAYS = int(os.getenv("LOGS_RETENTION_DAYS", "0"))
+# Как часто запускать обслуживание, с; строк за одну транзакцию; сколько свободных
+# страниц SQLite возвращать ОС за один шаг incremental_vacuum
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_VACUUM_STEP = int(os.getenv("ARCHIVE_VACUUM_STEP", "2000"))
+
+# Маршрутизация новых заявок: broadcast — во все активные чаты, принимает нажавший первым;
+# tags — только в чаты, чьи теги (/chat_tags) встречаются в тексте; round_robin /
+# least_loaded — сразу назначить одному сотруднику (по кругу / с наименьшим числом заявок
+# в работе) и прислать ему в личку
+ROUTING_STRATEGY = os.getenv("ROUTING_STRATEGY", "broadcast").lower()
+if ROUTING_STRATEGY not in ("broadcast", "tags", "round_robin", "least_loaded"):
+    raise RuntimeError(f"Unknown ROUTING_STRATEGY: {ROUTING_STRATEGY}")
+# Сколько заявок в работе может быть у сотрудника при автоназначении; 0 — без предела.
+# Если свободных нет, заявка рассылается по чатам как при broadcast
+ROUTING_MAX_LOAD = int(os.getenv("ROUTING_MAX_LOAD", "0"))
+
+# SLA: через сколько минут напомнить о непринятой заявке (ответом на её копии в чатах,
+# заодно она допубликовывается в активные чаты, куда не попала) и через сколько часов —
+# исполнителю о незавершённой; 0 (по умолчанию) — не напоминать. Напоминания повторяются
+# с тем же интервалом, последнее из SLA_MAX_REMINDERS уходит ещё и админам из ADMIN_USER_IDS
+SLA_ACCEPT_MINUTES = float(os.getenv("SLA_ACCEPT_MINUTES", "0"))
+SLA_STALE_HOURS = float(os.getenv("SLA_STALE_HOURS", "0"))
+SLA_MAX_REMINDERS = int(os.getenv("SLA_MAX_REMINDERS", "3"))
+
+# Рассылка заявок по чатам поддержки
+PUBLISH_CONCURRENCY = int(os.getenv("PUBLISH_CONCURRENCY", "8"))
+
+# Фоновая очередь публикаций
+PUBLISH_WORKERS = int(os.getenv("PUBLISH_WORKERS", "4"))
+PUBLISH_MAX_ATTEMPTS = int(os.getenv("PUBLISH_MAX_ATTEMPTS", "5"))
+# Сколько секунд задание публикации закреплено за взявшим его экземпляром
+PUBLISH_LEASE_SECONDS = int(os.getenv("PUBLISH_LEASE_SECONDS", "300"))
+# Фоновое обновление статуса заявки во всех чатах поддержки
+STATUS_SYNC_WORKERS = int(os.getenv("STATUS_SYNC_WORKERS", "2"))
+
+# Кэш ролей пользователей (проверка прав на кнопках и командах)
+ROLE_CACHE_TTL = float(os.getenv("ROLE_CACHE_TTL", "300"))
+ROLE_CACHE_SIZE = int(os.getenv("ROLE_CACHE_SIZE", "10000"))
+
+# Размер страницы в /all_history и /my_history
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+# /search ранжирует не больше стольких самых свежих совпадений
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "10000"))
+
+# За сколько последних дней показывать /stats
+STATS_DAYS = int(os.getenv("STATS_DAYS", "7"))
+
+# /export: строк за одну выборку из курсора и предел размера файла, МБ
+# (Bot API принимает до 50 МБ, локальный сервер Bot API — до 2000)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_MAX_FILE_MB = int(os.getenv("EXPORT_MAX_FILE_MB", "50"))
+
+# Как часто обновлять статус /republish_new_tickets, с
+REPUBLISH_PROGRESS_INTERVAL = float(os.getenv("REPUBLISH_PROGRESS_INTERVAL", "3"))
+
+# Буферизованная запись аудита (таблица logs)
+LOG_FLUSH_SIZE = int(os.getenv("LOG_FLUSH_SIZE", "100"))
+LOG_FLUSH_INTERVAL_MS = int(os.getenv("LOG_FLUSH_INTERVAL_MS", "500"))
+LOG_MAX_BUFFER = int(os.getenv("LOG_MAX_BUFFER", "10000"))
+
+# Сборка альбомов (media group): пауза после последнего элемента, общий предел ожидания, с;
+# и сколько альбомов одновременно держим в памяти
+ALBUM_LATENCY = float(os.getenv("ALBUM_LATENCY", "0.6"))
+ALBUM_MAX_WAIT = float(os.getenv("ALBUM_MAX_WAIT", "5"))
+ALBUM_MAX_GROUPS = int(os.getenv("ALBUM_MAX_GROUPS", "1000"))
+
+# Защита от флуда: сообщений в минуту от одного пользователя и запас на всплеск — лишние
+# отбрасываются до хендлеров (0 — без ограничения); сколько пользователей помнить
+INBOUND_RATE_PER_MINUTE = float(os.getenv("INBOUND_RATE_PER_MINUTE", "20"))
+INBOUND_BURST = float(os.getenv("INBOUND_BURST", "10"))
+INBOUND_MAX_USERS = int(os.getenv("INBOUND_MAX_USERS", "10000"))
+# Окно склейки, с: новая заявка публикуется через столько секунд, а сообщения автора,
+# пришедшие до публикации, дописываются в неё; 0 — каждое сообщение сразу отдельная заявка
+TICKET_MERGE_WINDOW = float(os.getenv("TICKET_MERGE_WINDOW", "0"))
+
+# Режим получения апдейтов: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# false — не сбрасывать накопившиеся апдейты при рестарте
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "true").lower() in ("1", "true", "yes")
+# Сколько апдейтов обрабатывается одновременно
+UPDATES_CONCURRENCY = int(os.getenv("UPDATES_CONCURRENCY", "100"))
+# Лимиты Bot API на все запросы бота: сообщений/с всего, в минуту на группу, в секунду в личку
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_GROUP_PER_MINUTE = float(os.getenv("TELEGRAM_GROUP_PER_MINUTE", "20"))
+TELEGRAM_PRIVATE_RATE = float(os.getenv("TELEGRAM_PRIVATE_RATE", "1"))
+# Повторы после 429 (retry_after) и 5xx
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+# Свой адрес Bot API (локальный сервер или фейк для тестов); пусто — api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# Webhook: публичный адрес, путь и секрет (X-Telegram-Bot-Api-Secret-Token)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise RuntimeError("WEBHOOK_URL must be set when BOT_MODE=webhook!")
+# Без секрета aiohttp-сервер принял бы апдейт от любого, кто знает адрес
+if BOT_MODE == "webhook" and not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET or ""):
+    raise RuntimeError("WEBHOOK_SECRET (1-256 chars: A-Z, a-z, 0-9, _, -) must be set when BOT_MODE=webhook!")
+
+# Prometheus-метрики на http://METRICS_HOST:METRICS_PORT/metrics; 0 — выключено
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
 
 # Только user_id в ADMIN_USER_IDS обладают абсолютной ролью admin!
@@ -1,66 +1,79 @@
+import asyncio
+import json
+import os
+import re
 import aiosqlite
 import logging
-from config import DATABASE_PATH, ADMIN_USER_IDS
+from contextlib import aclosing, asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from cache import TTLCache, MISSING
+from metrics import track_query, mark_query_failed
+from migrations import migrate, TICKET_TSVECTOR, ARCHIVE_TABLES, ARCHIVE_SQLITE_SCHEMA
+from storage import create_storage
+from config import (
+    STORAGE_BACKEND, DATABASE_PATH, DATABASE_URL, ADMIN_USER_IDS, DB_POOL_SIZE, DB_BUSY_TIMEOUT_MS,
+    ROLE_CACHE_TTL, ROLE_CACHE_SIZE, SEARCH_MAX_CANDIDATES, LOG_FLUSH_SIZE, LOG_FLUSH_INTERVAL_MS, LOG_MAX_BUFFER,
+    ARCHIVE_DATABASE_PATH, SLA_ACCEPT_MINUTES, SLA_STALE_HOURS
+)
 
 logger = logging.getLogger(__name__)
 
+
+def _query_error(name: str, e: Exception):
+    """Ошибка БД, которую функция глушит сама: в лог и в метрики как outcome="error"."""
+    logger.error(f"{name} error: {e}")
+    mark_query_failed()
+
+
+# --- STORAGE ---
+
+_storage = None
+
+
+async def open_pool(path: str = DATABASE_PATH, size: int = DB_POOL_SIZE):
+    """Открывает хранилище STORAGE_BACKEND: пул SQLite по path или пул PostgreSQL по DATABASE_URL."""
+    global _storage
+    if _storage is None:
+        storage = create_storage(STORAGE_BACKEND, path, DATABASE_URL, size, DB_BUSY_TIMEOUT_MS)
+        await storage.open()
+        _storage = storage
+        logger.info(f"DB pool opened: {STORAGE_BACKEND} (size={size})")
+    return _storage
+
+
+async def close_pool():
+    global _storage
+    if _storage is not None:
+        await _storage.close()
+        _storage = None
+        logger.info("DB pool closed")
+
+
+def pool_stats() -> dict:
+    return _storage.stats() if _storage is not None else {}
+
+
+def dialect() -> str:
+    return _storage.dialect if _storage is not None else "sqlite"
+
+
+@asynccontextmanager
+async def connection():
+    """Соединение из пула; без пула (скрипты, миграции вручную) — разовое к SQLite."""
+    if _storage is not None:
+        async with _storage.acquire() as db:
+            yield db
+    else:
+        async with aiosqlite.connect(DATABASE_PATH) as db:
+            yield db
+
 # Инициализация базы
+@track_query
 async def init_db():
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            # Таблица пользователей
-            await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE,
-                username TEXT,
-                role TEXT DEFAULT 'user'
-            )""")
-            # Таблица чатов поддержки
-            await db.execute("""
-            CREATE TABLE IF NOT EXISTS support_chats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER UNIQUE,
-                title TEXT,
-                is_active BOOLEAN DEFAULT 0,
-                approved_by INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )""")
-            # Таблица тикетов
-            await db.execute("""
-            CREATE TABLE IF NOT EXISTS tickets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                username TEXT,
-                text TEXT,
-                status TEXT DEFAULT 'new',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )""")
-            # Медиа тикетов
-            await db.execute("""
-            CREATE TABLE IF NOT EXISTS ticket_media (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ticket_id INTEGER,
-                type TEXT,
-                file_id TEXT
-            )""")
-            # Где и что опубликовано
-            await db.execute("""
-            CREATE TABLE IF NOT EXISTS ticket_publications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ticket_id INTEGER,
-                chat_id INTEGER,
-                message_id INTEGER
-            )""")
-            # Логи
-            await db.execute("""
-            CREATE TABLE IF NOT EXISTS logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                action TEXT,
-                user_id INTEGER,
-                details TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )""")
+        async with connection() as db:
+            version = await migrate(db, dialect())
+            logger.info(f"DB schema version: {version}")
 
             # ---- ДОБАВЛЯЕМ АДМИНОВ ИЗ .env В users, если их нет ----
             for admin_id in ADMIN_USER_IDS:
@@ -73,31 +86,63 @@ async def init_db():
                     )
 
             await db.commit()
+            role_cache.clear()
             logger.info("DB initialized")
+        await load_active_chats()
     except Exception as e:
+        # На недомигрированной схеме бот падал бы уже на заявках — останавливаем запуск
         logger.error(f"DB init error: {e}")
+        raise
 
 # --- USERS ---
 
+# telegram_id -> role (None — пользователя нет в базе)
+role_cache = TTLCache(ROLE_CACHE_SIZE, ROLE_CACHE_TTL)
+
+@track_query
 async def add_or_update_user(telegram_id: int, username: str):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         await db.execute("""
             INSERT INTO users (telegram_id, username, role)
             VALUES (?, ?, COALESCE((SELECT role FROM users WHERE telegram_id=?), 'user'))
             ON CONFLICT(telegram_id) DO UPDATE SET username=excluded.username
         """, (telegram_id, username, telegram_id))
         await db.commit()
+    role_cache.invalidate(telegram_id)
 
 
+@track_query
 async def get_user_by_id(telegram_id):
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with connection() as db:
             async with db.execute(
                 "SELECT * FROM users WHERE telegram_id=?", (telegram_id,)
             ) as cur:
                 return await cur.fetchone()
     except Exception as e:
-        logger.error(f"get_user_by_id error: {e}")
+        _query_error("get_user_by_id", e)
+
+async def get_user_role(telegram_id):
+    """Роль пользователя из кэша; в БД идём только при промахе."""
+    role = role_cache.get(telegram_id, MISSING)
+    if role is not MISSING:
+        return role
+    return await _load_user_role(telegram_id)
+
+@track_query
+async def _load_user_role(telegram_id):
+    try:
+        async with connection() as db:
+            async with db.execute(
+                "SELECT role FROM users WHERE telegram_id=?", (telegram_id,)
+            ) as cur:
+                row = await cur.fetchone()
+    except Exception as e:
+        _query_error("get_user_role", e)
+        return None
+    role = row[0] if row else None
+    role_cache.set(telegram_id, role)
+    return role
 
 async def is_admin(telegram_id):
     from config import ADMIN_USER_IDS
@@ -105,158 +150,560 @@ async def is_admin(telegram_id):
 
 # --- SUPPORT CHATS ---
 
+# Снимок активных чатов поддержки: читается на каждой заявке без обращения к БД,
+# обновляется только функциями ниже, которые пишут в support_chats
+_active_chats = set()
+
+@track_query
+async def load_active_chats():
+    try:
+        async with connection() as db:
+            async with db.execute(
+                "SELECT chat_id FROM support_chats WHERE is_active=1"
+            ) as cur:
+                rows = await cur.fetchall()
+        _active_chats.clear()
+        _active_chats.update(row[0] for row in rows)
+        logger.info(f"Active support chats loaded: {len(_active_chats)}")
+    except Exception as e:
+        _query_error("load_active_chats", e)
+
+@track_query
 async def add_support_chat(chat_id, title):
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with connection() as db:
             await db.execute(
-                "INSERT OR IGNORE INTO support_chats (chat_id, title) VALUES (?, ?)",
+                "INSERT INTO support_chats (chat_id, title) VALUES (?, ?) ON CONFLICT(chat_id) DO NOTHING",
                 (chat_id, title)
             )
             await db.commit()
+            async with db.execute(
+                "SELECT is_active FROM support_chats WHERE chat_id=?", (chat_id,)
+            ) as cur:
+                row = await cur.fetchone()
+        if row and row[0]:
+            _active_chats.add(chat_id)
+        else:
+            _active_chats.discard(chat_id)
     except Exception as e:
-        logger.error(f"add_support_chat error: {e}")
+        _query_error("add_support_chat", e)
 
+@track_query
 async def set_chat_active(chat_id, is_active, approved_by=None):
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute(
+        async with connection() as db:
+            cur = await db.execute(
                 "UPDATE support_chats SET is_active=?, approved_by=? WHERE chat_id=?",
                 (1 if is_active else 0, approved_by, chat_id)
             )
             await db.commit()
+        if is_active and cur.rowcount:
+            _active_chats.add(chat_id)
+        elif not is_active:
+            _active_chats.discard(chat_id)
     except Exception as e:
-        logger.error(f"set_chat_active error: {e}")
+        _query_error("set_chat_active", e)
 
+@track_query
 async def get_all_chats():
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with connection() as db:
             async with db.execute(
                 "SELECT chat_id, title, is_active FROM support_chats"
             ) as cur:
                 return await cur.fetchall()
     except Exception as e:
-        logger.error(f"get_all_chats error: {e}")
+        _query_error("get_all_chats", e)
         return []
 
 async def get_active_support_chats():
+    return [(chat_id,) for chat_id in _active_chats]
+
+async def get_admins():
+    from config import ADMIN_USER_IDS
+    return ADMIN_USER_IDS
+
+@track_query
+async def get_chat_tags():
+    """Чаты с тегами: [(chat_id, "тег1 тег2"), ...]."""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with connection() as db:
             async with db.execute(
-                "SELECT chat_id FROM support_chats WHERE is_active=1"
+                "SELECT chat_id, tags FROM support_chats WHERE tags IS NOT NULL AND tags != ''"
             ) as cur:
                 return await cur.fetchall()
     except Exception as e:
-        logger.error(f"get_active_support_chats error: {e}")
+        _query_error("get_chat_tags", e)
         return []
 
-async def get_admins():
-    from config import ADMIN_USER_IDS
-    return ADMIN_USER_IDS
+@track_query
+async def set_chat_tags(chat_id, tags: str):
+    """False — такого чата нет."""
+    try:
+        async with connection() as db:
+            cur = await db.execute(
+                "UPDATE support_chats SET tags=? WHERE chat_id=?", (tags or None, chat_id)
+            )
+            await db.commit()
+            return cur.rowcount > 0
+    except Exception as e:
+        _query_error("set_chat_tags", e)
+        return False
 
 # --- TICKETS ---
 
+# Статистика по дням (ticket_stats_daily) пишется в той же транзакции, что и заявка
+
+def _as_datetime(value):
+    # SQLite отдаёт TIMESTAMP строкой, PostgreSQL — datetime
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+async def _stats_created(db):
+    await db.execute(
+        "INSERT INTO ticket_stats_daily (day, created) VALUES (?, 1) "
+        "ON CONFLICT(day) DO UPDATE SET created = ticket_stats_daily.created + 1",
+        (_utc_timestamp().date().isoformat(),)
+    )
+
+async def _stats_event(db, counter: str, metric: str, now, started):
+    """counter += 1 за день now и учёт длительности now - started в metric_sum/_max/_n."""
+    seconds = max(0.0, (now - _as_datetime(started)).total_seconds()) if started else None
+    greatest = "GREATEST" if dialect() == "postgres" else "MAX"
+    await db.execute(f"""
+        INSERT INTO ticket_stats_daily (day, {counter}, {metric}_sum, {metric}_max, {metric}_n)
+        VALUES (?, 1, ?, ?, ?)
+        ON CONFLICT(day) DO UPDATE SET
+            {counter} = ticket_stats_daily.{counter} + 1,
+            {metric}_sum = ticket_stats_daily.{metric}_sum + excluded.{metric}_sum,
+            {metric}_max = {greatest}(ticket_stats_daily.{metric}_max, excluded.{metric}_max),
+            {metric}_n = ticket_stats_daily.{metric}_n + excluded.{metric}_n
+    """, (now.date().isoformat(), seconds or 0.0, seconds or 0.0, 1 if seconds is not None else 0))
+
+@track_query
+async def get_ticket_stats(since_day: str = None):
+    """Суммы ticket_stats_daily (за всё время или с since_day): (created, accepted, resolved,
+    accept_wait_sum, accept_wait_max, accept_wait_n, resolve_time_sum, resolve_time_max, resolve_time_n)."""
+    sql = """
+        SELECT COALESCE(SUM(created), 0), COALESCE(SUM(accepted), 0), COALESCE(SUM(resolved), 0),
+               COALESCE(SUM(accept_wait_sum), 0), COALESCE(MAX(accept_wait_max), 0), COALESCE(SUM(accept_wait_n), 0),
+               COALESCE(SUM(resolve_time_sum), 0), COALESCE(MAX(resolve_time_max), 0), COALESCE(SUM(resolve_time_n), 0)
+        FROM ticket_stats_daily
+    """
+    params = ()
+    if since_day:
+        sql += " WHERE day >= ?"
+        params = (since_day,)
+    try:
+        async with connection() as db:
+            async with db.execute(sql, params) as cur:
+                return await cur.fetchone()
+    except Exception as e:
+        _query_error("get_ticket_stats", e)
+
+@track_query
+async def get_ticket_stats_days(since_day: str):
+    """Строки ticket_stats_daily начиная с since_day, от новых дней к старым:
+    (day, created, accepted, resolved, accept_wait_sum, accept_wait_n, resolve_time_sum, resolve_time_n)."""
+    try:
+        async with connection() as db:
+            async with db.execute(
+                "SELECT day, created, accepted, resolved, accept_wait_sum, accept_wait_n, "
+                "resolve_time_sum, resolve_time_n FROM ticket_stats_daily WHERE day >= ? ORDER BY day DESC",
+                (since_day,)
+            ) as cur:
+                return await cur.fetchall()
+    except Exception as e:
+        _query_error("get_ticket_stats_days", e)
+        return []
+
+async def _set_timer(db, ticket_id, kind: str, seconds: float):
+    """SLA-таймер заявки (ticket_timers) в текущей транзакции; seconds = 0 — не заводить."""
+    if seconds:
+        await db.execute(
+            "INSERT INTO ticket_timers (ticket_id, kind, due_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(ticket_id, kind) DO UPDATE SET due_at=excluded.due_at, attempts=0",
+            (ticket_id, kind, _utc_timestamp() + timedelta(seconds=seconds))
+        )
+
+@track_query
 async def save_ticket(user_id, username, text):
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            cur = await db.execute(
-                "INSERT INTO tickets (user_id, username, text) VALUES (?, ?, ?)",
+        async with connection() as db:
+            async with db.execute(
+                "INSERT INTO tickets (user_id, username, text) VALUES (?, ?, ?) RETURNING id",
                 (user_id, username, text)
-            )
+            ) as cur:
+                ticket_id = (await cur.fetchone())[0]
+            await _stats_created(db)
             await db.commit()
-            return cur.lastrowid
+            return ticket_id
     except Exception as e:
-        logger.error(f"save_ticket error: {e}")
+        _query_error("save_ticket", e)
 
+@track_query
 async def save_ticket_media(ticket_id, media: list):
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            for m in media:
-                await db.execute(
+        async with connection() as db:
+            await db.executemany(
+                "INSERT INTO ticket_media (ticket_id, type, file_id) VALUES (?, ?, ?)",
+                [(ticket_id, m['type'], m['file_id']) for m in media]
+            )
+            await db.commit()
+    except Exception as e:
+        _query_error("save_ticket_media", e)
+
+@track_query
+async def create_ticket(user_id, username, text, media: list):
+    """Пользователь + заявка + медиа одной транзакцией (один commit)."""
+    try:
+        async with connection() as db:
+            await db.execute("""
+                INSERT INTO users (telegram_id, username, role)
+                VALUES (?, ?, COALESCE((SELECT role FROM users WHERE telegram_id=?), 'user'))
+                ON CONFLICT(telegram_id) DO UPDATE SET username=excluded.username
+            """, (user_id, username or "", user_id))
+            async with db.execute(
+                "INSERT INTO tickets (user_id, username, text) VALUES (?, ?, ?) RETURNING id",
+                (user_id, username, text)
+            ) as cur:
+                ticket_id = (await cur.fetchone())[0]
+            if media:
+                await db.executemany(
                     "INSERT INTO ticket_media (ticket_id, type, file_id) VALUES (?, ?, ?)",
-                    (ticket_id, m['type'], m['file_id'])
+                    [(ticket_id, m['type'], m['file_id']) for m in media]
                 )
+            # Задание на публикацию пишется в той же транзакции — не потеряется при рестарте
+            await db.execute(
+                "INSERT INTO pending_publications (ticket_id) VALUES (?)", (ticket_id,)
+            )
+            await _set_timer(db, ticket_id, "accept", SLA_ACCEPT_MINUTES * 60)
+            await _stats_created(db)
             await db.commit()
+            role_cache.invalidate(user_id)
+            return ticket_id
     except Exception as e:
-        logger.error(f"save_ticket_media error: {e}")
+        _query_error("create_ticket", e)
 
+@track_query
+async def append_ticket_message(ticket_id, text, media: list):
+    """Дописывает сообщение автора в новую, ещё не разосланную заявку (compare-and-set).
+
+    False — заявку уже приняли или опубликовали: сообщение должно стать новой заявкой.
+    """
+    try:
+        async with connection() as db:
+            async with db.execute("""
+                UPDATE tickets SET text = CASE
+                    WHEN ? = '' THEN text
+                    WHEN COALESCE(text, '') = '' THEN ?
+                    ELSE text || ?
+                END
+                WHERE id=? AND status='new'
+                  AND NOT EXISTS (SELECT 1 FROM ticket_publications WHERE ticket_id=?)
+                RETURNING id
+            """, (text, text, "\n" + text, ticket_id, ticket_id)) as cur:
+                if await cur.fetchone() is None:
+                    return False
+            if media:
+                await db.executemany(
+                    "INSERT INTO ticket_media (ticket_id, type, file_id) VALUES (?, ?, ?)",
+                    [(ticket_id, m['type'], m['file_id']) for m in media]
+                )
+            await db.commit()
+            return True
+    except Exception as e:
+        _query_error("append_ticket_message", e)
+        return False
+
+@track_query
 async def get_ticket(ticket_id):
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with connection() as db:
             async with db.execute(
                 "SELECT * FROM tickets WHERE id=?", (ticket_id,)
             ) as cur:
                 return await cur.fetchone()
     except Exception as e:
-        logger.error(f"get_ticket error: {e}")
+        _query_error("get_ticket", e)
 
+@track_query
 async def get_ticket_media(ticket_id):
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with connection() as db:
             async with db.execute(
                 "SELECT type, file_id FROM ticket_media WHERE ticket_id=?", (ticket_id,)
             ) as cur:
                 return await cur.fetchall()
     except Exception as e:
-        logger.error(f"get_ticket_media error: {e}")
+        _query_error("get_ticket_media", e)
         return []
 
+@track_query
+async def get_pending_publications():
+    try:
+        async with connection() as db:
+            async with db.execute(
+                "SELECT ticket_id, attempts FROM pending_publications ORDER BY id"
+            ) as cur:
+                return await cur.fetchall()
+    except Exception as e:
+        _query_error("get_pending_publications", e)
+        return []
+
+@track_query
+async def claim_pending_publication(ticket_id, lease_seconds: int):
+    """Берёт задание публикации в аренду на lease_seconds.
+
+    False — задания нет или его сейчас ведёт другой экземпляр бота.
+    """
+    now = _utc_timestamp()
+    if dialect() == "postgres":
+        sql = """
+            UPDATE pending_publications SET locked_until=? WHERE id = (
+                SELECT id FROM pending_publications
+                WHERE ticket_id=? AND (locked_until IS NULL OR locked_until < ?)
+                FOR UPDATE SKIP LOCKED
+            )"""
+    else:
+        sql = """
+            UPDATE pending_publications SET locked_until=?
+            WHERE ticket_id=? AND (locked_until IS NULL OR locked_until < ?)"""
+    try:
+        async with connection() as db:
+            cur = await db.execute(sql, (now + timedelta(seconds=lease_seconds), ticket_id, now))
+            await db.commit()
+            return cur.rowcount > 0
+    except Exception as e:
+        _query_error("claim_pending_publication", e)
+        return False
+
+@track_query
+async def get_pending_publication_lease(ticket_id):
+    """(есть_задание, locked_until): занято ли задание и до какого момента (наивный UTC).
+    None — запрос не удался."""
+    try:
+        async with connection() as db:
+            async with db.execute(
+                "SELECT locked_until FROM pending_publications WHERE ticket_id=?", (ticket_id,)
+            ) as cur:
+                row = await cur.fetchone()
+    except Exception as e:
+        _query_error("get_pending_publication_lease", e)
+        return None
+    if not row:
+        return False, None
+    return True, _as_datetime(row[0])
+
+@track_query
+async def release_pending_publications(ticket_ids: list):
+    """Снимает аренду с заданий, которые этот экземпляр не успел довести (остановка бота)."""
+    if not ticket_ids:
+        return
+    marks = ", ".join("?" * len(ticket_ids))
+    try:
+        async with connection() as db:
+            await db.execute(
+                f"UPDATE pending_publications SET locked_until = NULL WHERE ticket_id IN ({marks})",
+                list(ticket_ids)
+            )
+            await db.commit()
+    except Exception as e:
+        _query_error("release_pending_publications", e)
+
+@track_query
+async def bump_pending_publication(ticket_id):
+    try:
+        async with connection() as db:
+            # Аренда снимается: повтор возьмёт задание заново
+            await db.execute(
+                "UPDATE pending_publications SET attempts = attempts + 1, locked_until = NULL WHERE ticket_id=?",
+                (ticket_id,)
+            )
+            await db.commit()
+    except Exception as e:
+        _query_error("bump_pending_publication", e)
+
+@track_query
+async def delete_pending_publication(ticket_id):
+    try:
+        async with connection() as db:
+            await db.execute(
+                "DELETE FROM pending_publications WHERE ticket_id=?", (ticket_id,)
+            )
+            await db.commit()
+    except Exception as e:
+        _query_error("delete_pending_publication", e)
+
+@track_query
 async def register_publication(ticket_id, chat_id, message_id):
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with connection() as db:
             await db.execute(
-                "INSERT INTO ticket_publications (ticket_id, chat_id, message_id) VALUES (?, ?, ?)",
+                """
+                INSERT INTO ticket_publications (ticket_id, chat_id, message_id) VALUES (?, ?, ?)
+                ON CONFLICT(ticket_id, chat_id) DO UPDATE SET message_id=excluded.message_id
+                """,
                 (ticket_id, chat_id, message_id)
             )
             await db.commit()
     except Exception as e:
-        logger.error(f"register_publication error: {e}")
+        _query_error("register_publication", e)
+
+@track_query
+async def register_publications(publications: list):
+    """Батч (ticket_id, chat_id, message_id) одной транзакцией; False — не записался."""
+    try:
+        async with connection() as db:
+            await db.executemany(
+                """
+                INSERT INTO ticket_publications (ticket_id, chat_id, message_id) VALUES (?, ?, ?)
+                ON CONFLICT(ticket_id, chat_id) DO UPDATE SET message_id=excluded.message_id
+                """,
+                publications
+            )
+            await db.commit()
+        return True
+    except Exception as e:
+        _query_error("register_publications", e)
+        return False
+
+@track_query
+async def get_ticket_publications(ticket_id):
+    """Все копии заявки в чатах поддержки: [(chat_id, message_id), ...]."""
+    try:
+        async with connection() as db:
+            async with db.execute(
+                "SELECT chat_id, message_id FROM ticket_publications WHERE ticket_id=?", (ticket_id,)
+            ) as cur:
+                return await cur.fetchall()
+    except Exception as e:
+        _query_error("get_ticket_publications", e)
+        return []
 
+@track_query
 async def is_ticket_published(ticket_id, chat_id):
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with connection() as db:
             async with db.execute(
                 "SELECT id FROM ticket_publications WHERE ticket_id=? AND chat_id=?",
                 (ticket_id, chat_id)
             ) as cur:
                 return await cur.fetchone() is not None
     except Exception as e:
-        logger.error(f"is_ticket_published error: {e}")
+        _query_error("is_ticket_published", e)
         return False
 
+@track_query
+async def get_unpublished_new_tickets():
+    """Все новые заявки с активными чатами, где их ещё нет, и медиа — одним запросом.
+
+    Возвращает [(ticket_id, user_id, username, text, media, [chat_id, ...]), ...],
+    media — список (type, file_id).
+    """
+    # Агрегат медиа в JSON-массив [[type, file_id], ...]
+    items = (
+        "json_agg(json_build_array(type, file_id))" if dialect() == "postgres"
+        else "json_group_array(json_array(type, file_id))"
+    )
+    try:
+        async with connection() as db:
+            async with db.execute(f"""
+                WITH media AS (
+                    SELECT ticket_id, {items} AS items
+                    FROM ticket_media
+                    WHERE ticket_id IN (SELECT id FROM tickets WHERE status='new')
+                    GROUP BY ticket_id
+                )
+                SELECT t.id, t.user_id, t.username, t.text, m.items, c.chat_id
+                FROM tickets t
+                JOIN support_chats c ON c.is_active = 1
+                LEFT JOIN ticket_publications p ON p.ticket_id = t.id AND p.chat_id = c.chat_id
+                LEFT JOIN media m ON m.ticket_id = t.id
+                WHERE t.status = 'new' AND p.id IS NULL
+                ORDER BY t.id
+            """) as cur:
+                rows = await cur.fetchall()
+    except Exception as e:
+        _query_error("get_unpublished_new_tickets", e)
+        return []
+    tickets = {}
+    for ticket_id, user_id, username, text, items, chat_id in rows:
+        if ticket_id not in tickets:
+            media = [tuple(m) for m in json.loads(items)] if items else []
+            tickets[ticket_id] = (ticket_id, user_id, username, text, media, [])
+        tickets[ticket_id][5].append(chat_id)
+    return list(tickets.values())
+
+@track_query
 async def set_ticket_accepted(ticket_id, user_id):
+    """Атомарно забирает новую заявку на user_id (compare-and-set по status='new').
+
+    Возвращает (user_id автора, text) победителю; None — заявку уже приняли,
+    её нет или запрос не удался.
+    """
+    if dialect() == "postgres":
+        # Строку, которую сейчас забирает другой экземпляр, пропускаем, а не ждём её блокировку
+        where = "id = (SELECT id FROM tickets WHERE id=? AND status='new' FOR UPDATE SKIP LOCKED)"
+    else:
+        where = "id=? AND status='new'"
+    now = _utc_timestamp()
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute(
-                "UPDATE tickets SET status='accepted' WHERE id=? AND status='new'", (ticket_id,)
-            )
+        async with connection() as db:
+            async with db.execute(
+                f"UPDATE tickets SET status='accepted', assignee_id=?, accepted_at=? WHERE {where} "
+                "RETURNING user_id, text, created_at",
+                (user_id, now, ticket_id)
+            ) as cur:
+                row = await cur.fetchone()
+            if row:
+                await _stats_event(db, "accepted", "accept_wait", now, row[2])
+                await db.execute("DELETE FROM ticket_timers WHERE ticket_id=? AND kind='accept'", (ticket_id,))
+                await _set_timer(db, ticket_id, "stale", SLA_STALE_HOURS * 3600)
             await db.commit()
+            return row[:2] if row else None
     except Exception as e:
-        logger.error(f"set_ticket_accepted error: {e}")
+        _query_error("set_ticket_accepted", e)
 
+@track_query
 async def set_ticket_done(ticket_id):
+    """Закрывает принятую заявку; повторное закрытие ничего не меняет и не попадает в статистику.
+
+    Закрыть можно только заявку в работе: иначе «в работе» (accepted - resolved) в /stats ушло бы в минус.
+    True — заявку закрыл именно этот вызов.
+    """
+    now = _utc_timestamp()
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute(
-                "UPDATE tickets SET status='done' WHERE id=?", (ticket_id,)
-            )
+        async with connection() as db:
+            async with db.execute(
+                "UPDATE tickets SET status='done', done_at=? WHERE id=? AND status='accepted' RETURNING created_at",
+                (now, ticket_id)
+            ) as cur:
+                row = await cur.fetchone()
+            if row:
+                await _stats_event(db, "resolved", "resolve_time", now, row[0])
+                await db.execute("DELETE FROM ticket_timers WHERE ticket_id=?", (ticket_id,))
             await db.commit()
+            return row is not None
     except Exception as e:
-        logger.error(f"set_ticket_done error: {e}")
+        _query_error("set_ticket_done", e)
+        return False
 
+@track_query
 async def get_new_tickets():
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with connection() as db:
             async with db.execute(
                 "SELECT * FROM tickets WHERE status='new' ORDER BY created_at"
             ) as cur:
                 return await cur.fetchall()
     except Exception as e:
-        logger.error(f"get_new_tickets error: {e}")
+        _query_error("get_new_tickets", e)
         return []
 
+@track_query
 async def get_all_tickets():
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with connection() as db:
             async with db.execute(
                 "SELECT id, user_id, username, created_at, status, text FROM tickets ORDER BY created_at DESC"
             ) as cur:
@@ -264,47 +711,518 @@ async def get_all_tickets():
                 logger.info(f"get_all_tickets: found {len(rows)} tickets")
                 return rows
     except Exception as e:
-        logger.error(f"get_all_tickets error: {e}")
+        _query_error("get_all_tickets", e)
         return []
 
+@track_query
 async def get_user_tickets(user_id):
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with connection() as db:
             async with db.execute(
                 "SELECT id, created_at, status, text FROM tickets WHERE user_id=? ORDER BY created_at DESC", (user_id,)
             ) as cur:
                 return await cur.fetchall()
     except Exception as e:
-        logger.error(f"get_user_tickets error: {e}")
+        _query_error("get_user_tickets", e)
         return []
 
 
+@track_query
+async def get_tickets_page(before_id=None, after_id=None, limit=20, user_id=None, snippet_len=50):
+    """Страница истории по ключу id (keyset), без полного текста заявок.
+
+    before_id — более старые заявки, after_id — более новые. Возвращает
+    (rows, has_older, has_newer); rows идут от новых к старым:
+    (id, user_id, username, created_at, status, snippet, is_truncated).
+    """
+    where, params = [], []
+    if user_id is not None:
+        where.append("user_id=?")
+        params.append(user_id)
+    if after_id is not None:
+        where.append("id>?")
+        params.append(after_id)
+        order = "ASC"
+    else:
+        if before_id is not None:
+            where.append("id<?")
+            params.append(before_id)
+        order = "DESC"
+    sql = (
+        "SELECT id, user_id, username, created_at, status, substr(text, 1, ?), length(text) > ? "
+        "FROM tickets"
+        + (" WHERE " + " AND ".join(where) if where else "")
+        + f" ORDER BY id {order} LIMIT ?"
+    )
+    try:
+        async with connection() as db:
+            async with db.execute(sql, (snippet_len, snippet_len, *params, limit + 1)) as cur:
+                rows = await cur.fetchall()
+    except Exception as e:
+        _query_error("get_tickets_page", e)
+        return [], False, False
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id is not None:
+        rows.reverse()
+        return rows, True, has_more
+    return rows, has_more, before_id is not None
+
+# Маркеры подсветки в сниппетах поиска: управляющие символы не встречаются в тексте
+# заявок, history.py экранирует сниппет и заменяет их на <b></b>
+HIGHLIGHT_START, HIGHLIGHT_END = "\x02", "\x03"
+
+def _search_terms(query: str, max_terms: int = 8) -> list:
+    # Только слова: синтаксис FTS5/tsquery из пользовательского ввода не пропускаем
+    return re.findall(r"\w+", query.lower())[:max_terms]
+
+def _snippet(text: str, terms: list, width: int = 12) -> str:
+    """Окно из width слов вокруг первого совпадения; слова, начинающиеся с терминов, подсвечены."""
+    words = (text or "").split()
+
+    def hit(word):
+        token = re.search(r"\w+", word.lower())
+        return bool(token) and any(token.group().startswith(t) for t in terms)
+
+    first = next((i for i, w in enumerate(words) if hit(w)), 0)
+    start = max(0, first - width // 3)
+    end = start + width
+    shown = [f"{HIGHLIGHT_START}{w}{HIGHLIGHT_END}" if hit(w) else w for w in words[start:end]]
+    return ("… " if start else "") + " ".join(shown) + (" …" if end < len(words) else "")
+
+@track_query
+async def search_tickets(query: str, offset: int = 0, limit: int = 20, max_candidates: int = SEARCH_MAX_CANDIDATES):
+    """Полнотекстовый поиск по тексту заявок и username, лучшие совпадения первыми.
+
+    Все слова запроса обязательны и ищутся по префиксу. Ранжируются не больше
+    max_candidates самых свежих совпадений — частое слово не заставляет считать
+    релевантность по всей таблице. Возвращает (rows, has_more):
+    (id, user_id, username, created_at, status, snippet) — в snippet найденное
+    обрамлено HIGHLIGHT_START/HIGHLIGHT_END.
+    """
+    terms = _search_terms(query)
+    if not terms:
+        return [], False
+    if dialect() == "postgres":
+        match = " & ".join(f"{t}:*" for t in terms)
+        # ts_rank и ts_headline дорогие — считаем их по кандидатам и по странице соответственно
+        sql = f"""
+            WITH q AS (SELECT to_tsquery('russian', ?) AS q),
+            candidates AS (
+                SELECT id FROM tickets, q
+                WHERE {TICKET_TSVECTOR} @@ q.q
+                ORDER BY id DESC LIMIT ?
+            ),
+            page AS (
+                SELECT t.id, t.user_id, t.username, t.created_at, t.status, t.text,
+                       ts_rank({TICKET_TSVECTOR}, q.q) AS rank
+                FROM candidates c JOIN tickets t ON t.id = c.id, q
+                ORDER BY rank DESC, t.id DESC
+                LIMIT ? OFFSET ?
+            )
+            SELECT id, user_id, username, created_at, status,
+                   ts_headline('russian', coalesce(text, ''), q.q, ?)
+            FROM page, q
+            ORDER BY rank DESC, id DESC
+        """
+        params = (match, max_candidates, limit + 1, offset,
+                  f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxWords=20, MinWords=8")
+    else:
+        match = " ".join(f'"{t}"*' for t in terms)
+        # snippet() из FTS5 заново вычисляет MATCH на каждую строку — сниппет страницы
+        # строим в Python по тексту заявки
+        sql = """
+            WITH candidates AS (
+                SELECT rowid AS id, bm25(tickets_fts) AS score
+                FROM tickets_fts WHERE tickets_fts MATCH ?
+                ORDER BY rowid DESC LIMIT ?
+            )
+            SELECT t.id, t.user_id, t.username, t.created_at, t.status, t.text
+            FROM candidates c JOIN tickets t ON t.id = c.id
+            ORDER BY c.score, c.id DESC
+            LIMIT ? OFFSET ?
+        """
+        params = (match, max_candidates, limit + 1, offset)
+    try:
+        async with connection() as db:
+            async with db.execute(sql, params) as cur:
+                rows = await cur.fetchall()
+    except Exception as e:
+        _query_error("search_tickets", e)
+        return [], False
+    if dialect() != "postgres":
+        rows = [(*row[:5], _snippet(row[5], terms)) for row in rows]
+    return rows[:limit], len(rows) > limit
+
+# --- EXPORT ---
+
+async def _fetch_batches(db, sql: str, params, batch_size: int):
+    """Строки запроса пачками: курсор SQLite шагает по мере fetchmany,
+    в PostgreSQL — серверный курсор."""
+    if dialect() == "postgres":
+        async for rows in db.iterate(sql, params, batch_size):
+            yield rows
+        return
+    async with db.execute(sql, params) as cur:
+        while True:
+            rows = await cur.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+def _export_filter(since=None, until=None, status=None):
+    # since/until — datetime, until не включается
+    conditions, params = [], []
+    if since:
+        conditions.append("created_at >= ?")
+        params.append(since)
+    if until:
+        conditions.append("created_at < ?")
+        params.append(until)
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), tuple(params)
+
+async def iter_tickets_export(since=None, until=None, status=None, batch_size: int = 1000):
+    """Заявки по возрастанию id пачками: (id, user_id, username, text, status, created_at,
+    assignee_id, accepted_at, done_at, media, publications); media и publications —
+    JSON-массивы объектов {type, file_id} и {chat_id, message_id}.
+
+    Ошибки не глушатся: оборванная выгрузка не должна выглядеть полной.
+    """
+    where, params = _export_filter(since, until, status)
+    if dialect() == "postgres":
+        media = ("SELECT coalesce(json_agg(json_build_object('type', type, 'file_id', file_id) ORDER BY id), '[]') "
+                 "FROM ticket_media WHERE ticket_id = t.id")
+        publications = ("SELECT coalesce(json_agg(json_build_object('chat_id', chat_id, 'message_id', message_id) "
+                        "ORDER BY id), '[]') FROM ticket_publications WHERE ticket_id = t.id")
+    else:
+        media = ("SELECT json_group_array(json_object('type', type, 'file_id', file_id)) "
+                 "FROM (SELECT type, file_id FROM ticket_media WHERE ticket_id = t.id ORDER BY id)")
+        publications = ("SELECT json_group_array(json_object('chat_id', chat_id, 'message_id', message_id)) "
+                        "FROM (SELECT chat_id, message_id FROM ticket_publications WHERE ticket_id = t.id ORDER BY id)")
+    sql = f"""
+        SELECT id, user_id, username, text, status, created_at, assignee_id, accepted_at, done_at,
+               ({media}), ({publications})
+        FROM tickets t{where}
+        ORDER BY id
+    """
+    async with connection() as db, aclosing(_fetch_batches(db, sql, params, batch_size)) as batches:
+        async for rows in batches:
+            yield rows
+
+async def iter_logs_export(since=None, until=None, batch_size: int = 1000):
+    """Журнал действий по возрастанию id пачками: (id, action, user_id, details, created_at)."""
+    where, params = _export_filter(since, until)
+    sql = f"SELECT id, action, user_id, details, created_at FROM logs{where} ORDER BY id"
+    async with connection() as db, aclosing(_fetch_batches(db, sql, params, batch_size)) as batches:
+        async for rows in batches:
+            yield rows
+
+# --- SLA TIMERS ---
+
+async def iter_ticket_timers(batch_size: int = 1000):
+    """Все таймеры пачками [(ticket_id, kind, due_at, attempts), ...] — для сборки кучи при старте."""
+    async with connection() as db, aclosing(_fetch_batches(
+        db, "SELECT ticket_id, kind, due_at, attempts FROM ticket_timers", (), batch_size
+    )) as batches:
+        async for rows in batches:
+            yield rows
+
+@track_query
+async def get_ticket_timer(ticket_id, kind: str):
+    """(due_at, attempts) или None."""
+    try:
+        async with connection() as db:
+            async with db.execute(
+                "SELECT due_at, attempts FROM ticket_timers WHERE ticket_id=? AND kind=?", (ticket_id, kind)
+            ) as cur:
+                return await cur.fetchone()
+    except Exception as e:
+        _query_error("get_ticket_timer", e)
+
+@track_query
+async def claim_ticket_timer(ticket_id, kind: str, attempts: int, next_due=None):
+    """Забирает сработавший таймер (compare-and-set по attempts): переносит на next_due
+    или, если next_due None, удаляет. False — таймер уже снят или сработал в другом экземпляре.
+    """
+    if next_due is None:
+        sql, params = "DELETE FROM ticket_timers WHERE ticket_id=? AND kind=? AND attempts=?", (ticket_id, kind, attempts)
+    else:
+        sql = "UPDATE ticket_timers SET attempts=attempts+1, due_at=? WHERE ticket_id=? AND kind=? AND attempts=?"
+        params = (next_due, ticket_id, kind, attempts)
+    try:
+        async with connection() as db:
+            cur = await db.execute(sql, params)
+            await db.commit()
+            return cur.rowcount > 0
+    except Exception as e:
+        _query_error("claim_ticket_timer", e)
+        return False
+
+@track_query
+async def delete_ticket_timer(ticket_id, kind: str):
+    try:
+        async with connection() as db:
+            await db.execute("DELETE FROM ticket_timers WHERE ticket_id=? AND kind=?", (ticket_id, kind))
+            await db.commit()
+    except Exception as e:
+        _query_error("delete_ticket_timer", e)
+
+# --- ARCHIVE ---
+
+def _archive_table(table: str) -> str:
+    return f"{table}_archive" if dialect() == "postgres" else f"archive.{table}"
+
+@asynccontextmanager
+async def _archive_connection(create: bool = True):
+    """Соединение из пула, в котором видны таблицы архива (_archive_table):
+    в SQLite к нему на время подключается файл ARCHIVE_DATABASE_PATH
+    (create=False — без создания схемы, для чтения)."""
+    async with connection() as db:
+        if dialect() == "postgres":
+            yield db
+            return
+        await db.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DATABASE_PATH,))
+        try:
+            if create:
+                for sql in ARCHIVE_SQLITE_SCHEMA:
+                    await db.execute(sql)
+                await db.commit()
+            yield db
+        finally:
+            if db.in_transaction:
+                await db.rollback()
+            await db.execute("DETACH DATABASE archive")
+
+@track_query
+async def archive_done_tickets(before, batch_size: int) -> int:
+    """Переносит в архив до batch_size заявок done, завершённых раньше before,
+    вместе с вложениями и публикациями. Возвращает число перенесённых заявок."""
+    postgres = dialect() == "postgres"
+    async with _archive_connection() as db:
+        # created_at <= done_at: условие по created_at выбирает кандидатов по индексу (status, created_at);
+        # у заявок, закрытых до появления done_at, возраст считается от создания
+        async with db.execute(
+            "SELECT id FROM tickets WHERE status = 'done' AND created_at < ? AND COALESCE(done_at, created_at) < ? "
+            "ORDER BY created_at LIMIT ?" + (" FOR UPDATE SKIP LOCKED" if postgres else ""),
+            (before, before, batch_size)
+        ) as cur:
+            ids = [row[0] for row in await cur.fetchall()]
+        if not ids:
+            await db.rollback()
+            return 0
+        marks = ", ".join("?" * len(ids))
+        for table, columns in ARCHIVE_TABLES.items():
+            key = "id" if table == "tickets" else "ticket_id"
+            columns = ", ".join(columns)
+            await db.execute(
+                f"INSERT INTO {_archive_table(table)} ({columns}) "
+                f"SELECT {columns} FROM {table} WHERE {key} IN ({marks}) ON CONFLICT(id) DO NOTHING",
+                ids
+            )
+        if not postgres:
+            # Транзакция через ATTACH в режиме WAL не атомарна между файлами: сначала
+            # фиксируем копию в архиве, потом удаляем. После сбоя между шагами заявка
+            # останется в обеих базах и будет дочищена следующим проходом
+            await db.commit()
+        for table in ("ticket_media", "ticket_publications", "pending_publications"):
+            await db.execute(f"DELETE FROM {table} WHERE ticket_id IN ({marks})", ids)
+        await db.execute(f"DELETE FROM tickets WHERE id IN ({marks})", ids)
+        await db.commit()
+    return len(ids)
+
+@track_query
+async def prune_logs(before, batch_size: int) -> int:
+    """Удаляет до batch_size записей журнала старше before. Возвращает число удалённых."""
+    # id растёт вместе с created_at: смотрим только batch_size самых старых записей по
+    # первичному ключу, а не сканируем весь журнал, когда удалять уже нечего
+    async with connection() as db:
+        cur = await db.execute(
+            "DELETE FROM logs WHERE id IN ("
+            "SELECT id FROM (SELECT id, created_at FROM logs ORDER BY id LIMIT ?) oldest WHERE created_at < ?)",
+            (batch_size, before)
+        )
+        await db.commit()
+    return cur.rowcount
+
+@track_query
+async def incremental_vacuum(pages: int):
+    """SQLite: возвращает ОС до pages свободных страниц. Возвращает число
+    освобождённых страниц или None, если база создана без auto_vacuum=INCREMENTAL.
+    В PostgreSQL место переиспользует autovacuum — 0."""
+    if dialect() == "postgres":
+        return 0
+    async with connection() as db:
+        async with db.execute("PRAGMA auto_vacuum") as cur:
+            if (await cur.fetchone())[0] != 2:
+                return None
+        async with db.execute("PRAGMA freelist_count") as cur:
+            free_before = (await cur.fetchone())[0]
+        # Каждый шаг этой PRAGMA освобождает одну страницу, а курсор sqlite3 делает только
+        # первый — executescript выполняет её до конца. Параметры PRAGMA не поддерживает
+        await db.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        async with db.execute("PRAGMA freelist_count") as cur:
+            return free_before - (await cur.fetchone())[0]
+
+@track_query
+async def get_archived_ticket(ticket_id):
+    """Заявка из архива: (ticket, media, publications) или None. ticket — колонки как у
+    SELECT * FROM tickets, media — [(type, file_id)], publications — [(chat_id, message_id)]."""
+    if dialect() == "sqlite" and not os.path.exists(ARCHIVE_DATABASE_PATH):
+        # Архивация ещё ни разу не запускалась — файл архива не создаём
+        return None
+    try:
+        async with _archive_connection(create=False) as db:
+            async with db.execute(
+                f"SELECT {', '.join(ARCHIVE_TABLES['tickets'])} FROM {_archive_table('tickets')} WHERE id=?",
+                (ticket_id,)
+            ) as cur:
+                ticket = await cur.fetchone()
+            if not ticket:
+                return None
+            async with db.execute(
+                f"SELECT type, file_id FROM {_archive_table('ticket_media')} WHERE ticket_id=? ORDER BY id",
+                (ticket_id,)
+            ) as cur:
+                media = await cur.fetchall()
+            async with db.execute(
+                f"SELECT chat_id, message_id FROM {_archive_table('ticket_publications')} WHERE ticket_id=? ORDER BY id",
+                (ticket_id,)
+            ) as cur:
+                publications = await cur.fetchall()
+        return ticket, media, publications
+    except Exception as e:
+        _query_error("get_archived_ticket", e)
+
+@track_query
+async def get_staff_loads():
+    """Сотрудники (staff/admin) и число их заявок в работе: [(telegram_id, accepted), ...]."""
+    try:
+        async with connection() as db:
+            async with db.execute("""
+                SELECT u.telegram_id, COUNT(t.id)
+                FROM users u
+                LEFT JOIN tickets t ON t.assignee_id = u.telegram_id AND t.status = 'accepted'
+                WHERE u.role IN ('staff', 'admin')
+                GROUP BY u.telegram_id
+            """) as cur:
+                return await cur.fetchall()
+    except Exception as e:
+        _query_error("get_staff_loads", e)
+        return []
+
 async def is_staff(user_id: int):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute("SELECT role FROM users WHERE telegram_id = ?", (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            return row is not None and row[0] == 'staff'
+    return await get_user_role(user_id) == 'staff'
 
 
+@track_query
 async def set_user_role(telegram_id: int, role: str):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         await db.execute(
             "UPDATE users SET role = ? WHERE telegram_id = ?",
             (role, telegram_id)
         )
         await db.commit()
+    role_cache.invalidate(telegram_id)
 
 
 
 # --- LOGGING ---
 
+def _utc_timestamp():
+    # Наивный UTC с точностью до секунды: в SQLite пишется в формате CURRENT_TIMESTAMP
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+@track_query
+async def _write_logs(records: list):
+    async with connection() as db:
+        await db.executemany(
+            "INSERT INTO logs (action, user_id, details, created_at) VALUES (?, ?, ?, ?)",
+            records
+        )
+        await db.commit()
+
+
+class LogWriter:
+    """Буферизованная запись аудита: log() кладёт запись в память, фоновая задача
+    сбрасывает её в БД одним executemany каждые batch_size записей или interval секунд.
+    """
+
+    def __init__(self, batch_size: int = LOG_FLUSH_SIZE, interval: float = LOG_FLUSH_INTERVAL_MS / 1000,
+                 max_buffer: int = LOG_MAX_BUFFER):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def qsize(self) -> int:
+        return len(self._buffer)
+
+    def put(self, record: tuple):
+        self._buffer.append(record)
+        if len(self._buffer) > self.max_buffer:
+            # БД недоступна слишком долго — жертвуем самыми старыми записями, а не памятью
+            dropped = len(self._buffer) - self.max_buffer
+            del self._buffer[:dropped]
+            logger.warning(f"log buffer overflow, dropped {dropped} records")
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        try:
+            await _write_logs(batch)
+        except Exception as e:
+            logger.error(f"log flush error: {e}")
+            self._buffer[:0] = batch
+        except BaseException:
+            # Отмена посреди записи: пачка не теряется, её запишет следующий flush
+            self._buffer[:0] = batch
+            raise
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Задача не отменяется: запись, начатая до остановки, дописывается до конца
+        if self._task is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+log_writer = LogWriter()
+
 async def log(action, user_id, details):
+    record = (action, user_id, details, _utc_timestamp())
+    if log_writer.running:
+        log_writer.put(record)
+        return
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute(
-                "INSERT INTO logs (action, user_id, details) VALUES (?, ?, ?)",
-                (action, user_id, details)
-            )
-            await db.commit()
+        await _write_logs([record])
     except Exception as e:
         logger.error(f"log error: {e}")
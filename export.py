@@ -0,0 +1,124 @@
+import asyncio
+import csv
+import gzip
+import json
+import os
+import tempfile
+from contextlib import aclosing
+from datetime import date, datetime, timedelta
+from config import EXPORT_BATCH_SIZE
+from db import iter_tickets_export, iter_logs_export
+
+# /export: строки идут из курсора пачками по EXPORT_BATCH_SIZE и сразу пишутся
+# в gzip-файл на диске — память не растёт с размером базы
+
+TICKET_COLUMNS = ("id", "user_id", "username", "text", "status", "created_at",
+                  "assignee_id", "accepted_at", "done_at", "media", "publications")
+LOG_COLUMNS = ("id", "action", "user_id", "details", "created_at")
+# Колонки с JSON-массивами: в CSV — строкой, в JSONL — вложенным списком
+JSON_COLUMNS = ("media", "publications")
+STATUSES = ("new", "accepted", "done")
+FORMATS = ("csv", "jsonl")
+
+EXPORT_USAGE = (
+    "Используй: /export tickets|logs [csv|jsonl] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД] [status=new|accepted|done]\n"
+    "Пример: /export tickets jsonl from=2026-01-01 status=done"
+)
+
+# Одна выгрузка за раз: она держит соединение из пула до конца
+_lock = asyncio.Lock()
+
+
+def export_running() -> bool:
+    return _lock.locked()
+
+def parse_export_args(command_text: str):
+    """'/export tickets csv from=... to=... status=...' -> (options, None) или (None, ошибка)."""
+    args = (command_text or "").split()[1:]
+    if not args or args[0] not in ("tickets", "logs"):
+        return None, EXPORT_USAGE
+    options = {"kind": args[0], "fmt": "csv", "since": None, "until": None, "status": None}
+    for arg in args[1:]:
+        key, _, value = arg.partition("=")
+        if not value and key in FORMATS:
+            options["fmt"] = key
+        elif key in ("from", "to"):
+            try:
+                day = date.fromisoformat(value)
+            except ValueError:
+                return None, f"Неверная дата: {value}. Формат ГГГГ-ММ-ДД."
+            if key == "from":
+                options["since"] = datetime(day.year, day.month, day.day)
+            else:
+                # to включительно: до начала следующего дня
+                options["until"] = datetime(day.year, day.month, day.day) + timedelta(days=1)
+        elif key == "status" and options["kind"] == "tickets" and value in STATUSES:
+            options["status"] = value
+        else:
+            return None, EXPORT_USAGE
+    return options, None
+
+def export_filename(options: dict) -> str:
+    parts = [options["kind"]]
+    if options["since"]:
+        parts.append(f"from_{options['since'].date()}")
+    if options["until"]:
+        parts.append(f"to_{(options['until'] - timedelta(days=1)).date()}")
+    if options["status"]:
+        parts.append(options["status"])
+    return "_".join(parts) + f".{options['fmt']}.gz"
+
+def _writer(out, columns, fmt):
+    """Функция записи пачки строк; вызывается в потоке, чтобы сжатие не блокировало event loop.
+
+    Время из PostgreSQL (datetime, TIMESTAMP(0)) str() печатает так же, как его хранит SQLite.
+    """
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        return writer.writerows
+
+    json_idx = [columns.index(c) for c in JSON_COLUMNS if c in columns]
+
+    def write(rows):
+        for row in rows:
+            record = dict(zip(columns, row))
+            for i in json_idx:
+                record[columns[i]] = json.loads(row[i])
+            out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    return write
+
+async def export_to_file(kind: str, fmt: str = "csv", since=None, until=None, status=None,
+                         batch_size: int = EXPORT_BATCH_SIZE):
+    """Пишет выгрузку во временный .gz-файл и возвращает (путь, число строк).
+
+    Удалить файл после отправки должен вызывающий; при ошибке файл удаляется здесь.
+    """
+    if kind == "tickets":
+        columns, batches = TICKET_COLUMNS, iter_tickets_export(since, until, status, batch_size)
+    else:
+        columns, batches = LOG_COLUMNS, iter_logs_export(since, until, batch_size)
+    fd, path = tempfile.mkstemp(prefix=f"export_{kind}_", suffix=f".{fmt}.gz")
+    os.close(fd)
+    total = 0
+    writing = None
+    async with _lock:
+        try:
+            with gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=6) as out:
+                write = _writer(out, columns, fmt)
+                async with aclosing(batches):
+                    # Пока пачка пишется, из базы читается следующая; в памяти не больше двух пачек
+                    async for rows in batches:
+                        if writing:
+                            await writing
+                        writing = asyncio.ensure_future(asyncio.to_thread(write, rows))
+                        total += len(rows)
+                if writing:
+                    await writing
+        except BaseException:
+            if writing and not writing.done():
+                # Поток записи не прервать — дожидаемся его, прежде чем удалять файл
+                await asyncio.wait([writing])
+            os.remove(path)
+            raise
+    return path, total
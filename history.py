@@ -0,0 +1,97 @@
+from html import escape
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from config import HISTORY_PAGE_SIZE
+from db import (
+    get_tickets_page, search_tickets, get_ticket, get_ticket_media, get_ticket_publications, get_archived_ticket,
+    HIGHLIGHT_START, HIGHLIGHT_END
+)
+
+# callback_data: hist:<all|my>:<o|n>:<id> — страница старее/новее заявки id
+# callback_data: srch:<page> — страница поиска; сам запрос берётся из сообщения /search,
+# на которое отвечает выдача (в 64 байта callback_data он может не влезть)
+
+# Сколько символов текста заявки показывать в /ticket (сообщение — до 4096)
+TICKET_TEXT_LIMIT = 3500
+
+
+def _format_line(row, with_author: bool):
+    ticket_id, user_id, username, created_at, status, snippet, truncated = row
+    snippet = escape(snippet or "") + ("..." if truncated else "")
+    if with_author:
+        return f"#{ticket_id} [{status}] {created_at} — @{escape(username or str(user_id))}: {snippet}"
+    return f"#{ticket_id} [{status}] — {snippet}"
+
+async def history_page(scope: str, direction: str = None, cursor: int = None, user_id=None):
+    """Одна страница истории: (text, reply_markup) или (None, None), если заявок нет."""
+    rows, has_older, has_newer = await get_tickets_page(
+        before_id=cursor if direction == "o" else None,
+        after_id=cursor if direction == "n" else None,
+        limit=HISTORY_PAGE_SIZE,
+        user_id=user_id,
+    )
+    if not rows:
+        return None, None
+    text = "\n".join(_format_line(row, with_author=scope == "all") for row in rows)
+    kb = InlineKeyboardBuilder()
+    if has_newer:
+        kb.button(text="⬅️ Новее", callback_data=f"hist:{scope}:n:{rows[0][0]}")
+    if has_older:
+        kb.button(text="Старее ➡️", callback_data=f"hist:{scope}:o:{rows[-1][0]}")
+    return text, kb.as_markup() if has_newer or has_older else None
+
+def parse_history_callback(data: str):
+    _, scope, direction, cursor = data.split(":")
+    return scope, direction, int(cursor)
+
+def _highlight(snippet: str) -> str:
+    return escape(snippet or "").replace(HIGHLIGHT_START, "<b>").replace(HIGHLIGHT_END, "</b>")
+
+async def search_page(query: str, page: int = 0):
+    """Страница результатов поиска: (text, reply_markup) или (None, None), если ничего не найдено."""
+    rows, has_more = await search_tickets(query, offset=page * HISTORY_PAGE_SIZE, limit=HISTORY_PAGE_SIZE)
+    if not rows:
+        return None, None
+    lines = [f"🔎 «{escape(query)}», стр. {page + 1}:"]
+    for ticket_id, user_id, username, created_at, status, snippet in rows:
+        lines.append(
+            f"#{ticket_id} [{status}] {created_at} — @{escape(username or str(user_id))}: {_highlight(snippet)}"
+        )
+    kb = InlineKeyboardBuilder()
+    if page > 0:
+        kb.button(text="⬅️ Назад", callback_data=f"srch:{page - 1}")
+    if has_more:
+        kb.button(text="Дальше ➡️", callback_data=f"srch:{page + 1}")
+    return "\n".join(lines), kb.as_markup() if page > 0 or has_more else None
+
+def search_query(command_text: str) -> str:
+    """Текст запроса из "/search <запрос>" (или "/search@bot <запрос>")."""
+    parts = (command_text or "").split(maxsplit=1)
+    return parts[1].strip() if len(parts) > 1 else ""
+
+async def ticket_card(ticket_id: int):
+    """Карточка заявки для /ticket — из основной базы или из архива; None, если заявки нет."""
+    ticket = await get_ticket(ticket_id)
+    archived = ticket is None
+    if archived:
+        found = await get_archived_ticket(ticket_id)
+        if not found:
+            return None
+        ticket, media, publications = found
+    else:
+        media = await get_ticket_media(ticket_id)
+        publications = await get_ticket_publications(ticket_id)
+    _, user_id, username, text, status, created_at, assignee_id, accepted_at, done_at = ticket[:9]
+    lines = [
+        f"<b>Заявка #{ticket_id}</b> [{status}]" + (" · 📦 в архиве" if archived else ""),
+        f"От: @{escape(username or str(user_id))} (id {user_id}), {created_at}",
+    ]
+    if accepted_at or assignee_id:
+        lines.append(f"Принята: {accepted_at or '—'}" + (f", staff id {assignee_id}" if assignee_id else ""))
+    if done_at:
+        lines.append(f"Завершена: {done_at}")
+    if media:
+        lines.append("Вложения: " + ", ".join(media_type for media_type, _ in media))
+    lines.append(f"Публикаций в чатах поддержки: {len(publications)}")
+    text = text or ""
+    lines += ["", escape(text[:TICKET_TEXT_LIMIT]) + ("..." if len(text) > TICKET_TEXT_LIMIT else "")]
+    return "\n".join(lines)
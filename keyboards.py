@@ -0,0 +1,18 @@
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+
+def gen_accept_kb(ticket_id: int):
+    kb = InlineKeyboardBuilder()
+    kb.button(text="Принять", callback_data=f"accept_{ticket_id}")
+    return kb.as_markup()
+
+def gen_done_kb(ticket_id: int):
+    kb = InlineKeyboardBuilder()
+    kb.button(text="Завершить", callback_data=f"done_{ticket_id}")
+    return kb.as_markup()
+
+def gen_status_kb(label: str):
+    # Неактивная кнопка со статусом вместо «Принять» на остальных копиях заявки
+    kb = InlineKeyboardBuilder()
+    kb.button(text=label, callback_data="noop")
+    return kb.as_markup()
@@ -0,0 +1,164 @@
+import contextvars
+import functools
+import logging
+import time
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge:
+    """Значение снимается в момент отдачи /metrics вызовом fn() -> {labels: value} или число."""
+
+    def __init__(self, name: str, help: str, fn, labelnames=()):
+        self.name, self.help, self.fn, self.labelnames = name, help, fn, tuple(labelnames)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.warning(f"gauge {self.name} failed: {e}")
+            return
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, v in items:
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            yield f"{self.name}{_labels(self.labelnames, labels)} {v}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value: float, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        counts = state[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                yield f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + (bound,))} {cumulative}"
+            yield f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + ('+Inf',))} {count}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+_registry = []
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Метрики бота ---
+
+UPDATE_LATENCY = register(Histogram(
+    "helpdesk_update_duration_seconds", "Full update processing time", ("update_type",)))
+HANDLER_LATENCY = register(Histogram(
+    "helpdesk_handler_duration_seconds", "Handler execution time", ("handler",)))
+HANDLER_TOTAL = register(Counter(
+    "helpdesk_handler_total", "Handler calls by outcome", ("handler", "outcome")))
+DB_LATENCY = register(Histogram(
+    "helpdesk_db_query_duration_seconds", "db.py call time", ("query",)))
+DB_TOTAL = register(Counter(
+    "helpdesk_db_queries_total", "db.py calls by outcome", ("query", "outcome")))
+API_LATENCY = register(Histogram(
+    "helpdesk_telegram_request_duration_seconds", "Bot API request time", ("method",)))
+API_TOTAL = register(Counter(
+    "helpdesk_telegram_requests_total", "Bot API requests by outcome", ("method", "outcome")))
+API_THROTTLE = register(Histogram(
+    "helpdesk_telegram_throttle_seconds", "Time Bot API requests waited for rate limit tokens", ("method",),
+    buckets=(0.001, 0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)))
+
+
+# Выставляется функциями db.py, которые сами ловят ошибку БД и возвращают значение по умолчанию
+_query_failed = contextvars.ContextVar("query_failed", default=False)
+
+
+def mark_query_failed():
+    """Отмечает текущий вызов под track_query как ошибочный, хотя исключение поймано внутри."""
+    _query_failed.set(True)
+
+
+def track_query(func):
+    """Декоратор для функций db.py: время и число вызовов по имени функции."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = "ok"
+        token = _query_failed.set(False)
+        try:
+            result = await func(*args, **kwargs)
+            if _query_failed.get():
+                outcome = "error"
+            return result
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            _query_failed.reset(token)
+            DB_LATENCY.observe(time.perf_counter() - started, name)
+            DB_TOTAL.inc(name, outcome)
+    return wrapper
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import (
+    SendMediaGroup, TelegramMethod, EditMessageText, EditMessageCaption, EditMessageReplyMarkup
+)
+from aiogram.types import Message, Update
+from config import (
+    ALBUM_LATENCY, ALBUM_MAX_WAIT, ALBUM_MAX_GROUPS, TELEGRAM_MAX_RETRIES,
+    ADMIN_USER_IDS, INBOUND_RATE_PER_MINUTE, INBOUND_BURST, INBOUND_MAX_USERS
+)
+from metrics import UPDATE_LATENCY, HANDLER_LATENCY, HANDLER_TOTAL, API_LATENCY, API_TOTAL, API_THROTTLE
+from ratelimit import ChatRateLimiter, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Telegram не присылает в альбоме больше 10 элементов
+ALBUM_MAX_ITEMS = 10
+# Правки сообщений (клавиатура после нажатия кнопки, статус заявки): проходят лимиты
+# раньше массовых рассылок в тот же чат. answerCallbackQuery без chat_id лимитами не ограничен
+INTERACTIVE_METHODS = (EditMessageText, EditMessageCaption, EditMessageReplyMarkup)
+
+
+class _Album:
+    __slots__ = ("messages", "changed", "closed", "started")
+
+    def __init__(self, first: Message):
+        self.messages = [first]
+        self.changed = asyncio.Event()
+        self.closed = False
+        self.started = time.monotonic()
+
+
+class AlbumMiddleware(BaseMiddleware):
+    """Собирает сообщения одного media_group_id в data["album"].
+
+    Первое сообщение группы ждёт, пока новые элементы перестанут приходить
+    (latency), но не дольше max_wait, и только оно доходит до хендлера —
+    остальные поглощаются. Одновременно буферизуется не больше max_groups
+    альбомов: при переполнении самый старый отправляется в обработку досрочно.
+    """
+
+    def __init__(self, latency: float = ALBUM_LATENCY, max_wait: float = ALBUM_MAX_WAIT,
+                 max_groups: int = ALBUM_MAX_GROUPS):
+        self.latency = latency
+        self.max_wait = max_wait
+        self.max_groups = max_groups
+        self._albums = OrderedDict()
+
+    def _close(self, album: _Album):
+        album.closed = True
+        album.changed.set()
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not event.media_group_id:
+            return await handler(event, data)
+
+        key = (event.chat.id, event.media_group_id)
+        album = self._albums.get(key)
+        if album is not None:
+            if not album.closed and len(album.messages) < ALBUM_MAX_ITEMS:
+                album.messages.append(event)
+                album.changed.set()
+            return None
+
+        album = _Album(event)
+        self._albums[key] = album
+        while len(self._albums) > self.max_groups:
+            _, oldest = self._albums.popitem(last=False)
+            logger.warning("album buffer full, flushing oldest media group early")
+            self._close(oldest)
+
+        try:
+            while not album.closed:
+                remaining = self.max_wait - (time.monotonic() - album.started)
+                if remaining <= 0:
+                    break
+                album.changed.clear()
+                try:
+                    await asyncio.wait_for(album.changed.wait(), timeout=min(self.latency, remaining))
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            album.closed = True
+            if self._albums.get(key) is album:
+                del self._albums[key]
+
+        data["album"] = sorted(album.messages, key=lambda m: m.message_id)
+        return await handler(event, data)
+
+
+class _Sender:
+    __slots__ = ("bucket", "warned")
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.warned = False
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.message: token bucket на каждого пользователя.
+
+    Сообщения сверх лимита отбрасываются до хендлеров — не создают заявок и не
+    расходуют лимиты Bot API на рассылку; о серии отброшенных пользователь узнаёт
+    одним предупреждением в личке. Bucket-ы хранятся в LRU не больше max_users штук.
+    Регистрируется после AlbumMiddleware, чтобы альбом считался одним сообщением.
+    """
+
+    def __init__(self, per_minute: float = INBOUND_RATE_PER_MINUTE, burst: float = INBOUND_BURST,
+                 max_users: int = INBOUND_MAX_USERS):
+        self.rate = per_minute / 60
+        self.burst = max(1.0, burst)
+        self.max_users = max_users
+        self._senders = OrderedDict()
+        self.passed = 0
+        self.dropped = 0
+
+    def stats(self) -> dict:
+        return {"passed": self.passed, "dropped": self.dropped, "users": len(self._senders)}
+
+    def _sender(self, user_id: int) -> _Sender:
+        sender = self._senders.get(user_id)
+        if sender is None:
+            sender = _Sender(TokenBucket(self.rate, self.burst))
+            self._senders[user_id] = sender
+            if len(self._senders) > self.max_users:
+                self._senders.popitem(last=False)
+        else:
+            self._senders.move_to_end(user_id)
+        return sender
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = event.from_user
+        if not self.rate or user is None or user.id in ADMIN_USER_IDS:
+            return await handler(event, data)
+
+        sender = self._sender(user.id)
+        if sender.bucket.try_acquire():
+            sender.warned = False
+            self.passed += 1
+            return await handler(event, data)
+
+        self.dropped += 1
+        if not sender.warned and event.chat.type == "private":
+            sender.warned = True
+            try:
+                await event.answer("Слишком много сообщений подряд. Подождите немного — пока новые сообщения не принимаются.")
+            except TelegramAPIError as e:
+                logger.warning(f"throttle notice failed: {e}")
+        return None
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """Ограничивает число апдейтов, обрабатываемых одновременно."""
+
+    def __init__(self, limit: int):
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with self._semaphore:
+            return await handler(event, data)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: полное время обработки апдейта по его типу."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            UPDATE_LATENCY.observe(time.perf_counter() - started, event.event_type)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner-middleware: время и исход конкретного хендлера (handle_single, accept_ticket, ...)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await handler(event, data)
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+            HANDLER_TOTAL.inc(name, outcome)
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время и исход каждого запроса к Bot API."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        name = type(method).__name__
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            outcome = "retry_after"
+            raise
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - started, name)
+            API_TOTAL.inc(name, outcome)
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: лимиты Telegram и повторы для всех запросов к Bot API.
+
+    Запрос с chat_id ждёт токены в bucket чата и в глобальном bucket — превысившие
+    лимит встают в очередь, а не получают 429. Правки сообщений (кнопки «Принять» /
+    «Завершить», синхронизация статуса) идут в приоритетной очереди и не ждут, пока
+    разойдётся массовая публикация в тот же чат. На 429 запрос повторяется через
+    retry_after, на 5xx — через экспоненциальную паузу, не больше max_retries раз.
+    """
+
+    def __init__(self, limiter: ChatRateLimiter, max_retries: int = TELEGRAM_MAX_RETRIES, backoff: float = 0.5):
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.waiting = 0
+        self.throttled = 0
+        self.retried = 0
+        self.failed = 0
+
+    def stats(self) -> dict:
+        return {"waiting": self.waiting, "throttled": self.throttled, "retried": self.retried, "failed": self.failed}
+
+    async def _acquire(self, name: str, chat_id, tokens: int, priority: bool):
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self.limiter.acquire(chat_id, tokens, priority)
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - started
+        if waited >= 0.001:
+            self.throttled += 1
+        API_THROTTLE.observe(waited, name)
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        name = type(method).__name__
+        # Без chat_id (answerCallbackQuery, getUpdates, ...) сообщения в чат не уходят
+        chat_id = getattr(method, "chat_id", None)
+        # Каждый элемент альбома Telegram считает отдельным сообщением
+        tokens = len(method.media) if isinstance(method, SendMediaGroup) else 1
+        priority = isinstance(method, INTERACTIVE_METHODS)
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                await self._acquire(name, chat_id, tokens, priority)
+            try:
+                return await make_request(bot, method)
+            except (TelegramRetryAfter, TelegramServerError) as e:
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    raise
+                self.retried += 1
+                delay = e.retry_after if isinstance(e, TelegramRetryAfter) else self.backoff * 2 ** attempt
+                logger.warning(f"{name} в чат {chat_id}: {type(e).__name__}, повтор через {delay} с")
+                await asyncio.sleep(delay)
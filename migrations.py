@@ -0,0 +1,440 @@
+import logging
+from config import SLA_ACCEPT_MINUTES, SLA_STALE_HOURS
+
+logger = logging.getLogger(__name__)
+
+# Версионированные миграции схемы. Текущая версия хранится в PRAGMA user_version
+# (SQLite) или в таблице schema_version (PostgreSQL), при старте применяются все
+# миграции с номером больше неё — каждая своей транзакцией.
+# Миграции только добавляются в конец списка; уже выпущенные не редактируются.
+# Список SQL общий для обеих СУБД, словарь {dialect: [...]} либо функция dialect -> [...],
+# если SQL зависит от настроек на момент применения.
+
+# Схема PostgreSQL, эквивалентная базовой схеме SQLite
+POSTGRES_BASE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id BIGSERIAL PRIMARY KEY,
+        telegram_id BIGINT UNIQUE,
+        username TEXT,
+        role TEXT DEFAULT 'user'
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS support_chats (
+        id BIGSERIAL PRIMARY KEY,
+        chat_id BIGINT UNIQUE,
+        title TEXT,
+        is_active INTEGER DEFAULT 0,
+        approved_by BIGINT,
+        created_at TIMESTAMP(0) DEFAULT (now() AT TIME ZONE 'utc')
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS tickets (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT,
+        username TEXT,
+        text TEXT,
+        status TEXT DEFAULT 'new',
+        created_at TIMESTAMP(0) DEFAULT (now() AT TIME ZONE 'utc')
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS ticket_media (
+        id BIGSERIAL PRIMARY KEY,
+        ticket_id BIGINT,
+        type TEXT,
+        file_id TEXT
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS ticket_publications (
+        id BIGSERIAL PRIMARY KEY,
+        ticket_id BIGINT,
+        chat_id BIGINT,
+        message_id BIGINT
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS pending_publications (
+        id BIGSERIAL PRIMARY KEY,
+        ticket_id BIGINT UNIQUE,
+        attempts INTEGER DEFAULT 0,
+        created_at TIMESTAMP(0) DEFAULT (now() AT TIME ZONE 'utc')
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS logs (
+        id BIGSERIAL PRIMARY KEY,
+        action TEXT,
+        user_id BIGINT,
+        details TEXT,
+        created_at TIMESTAMP(0) DEFAULT (now() AT TIME ZONE 'utc')
+    )""",
+]
+
+# Документ полнотекстового поиска в PostgreSQL: текст заявки и username автора
+TICKET_TSVECTOR = "to_tsvector('russian', coalesce(text, '') || ' ' || coalesce(username, ''))"
+
+# Архив старых заявок (db.archive_done_tickets): таблица -> переносимые колонки.
+# В SQLite архив — отдельный файл ARCHIVE_DATABASE_PATH, подключаемый как схема archive,
+# его схема создаётся при подключении (ARCHIVE_SQLITE_SCHEMA). В PostgreSQL — таблицы
+# <таблица>_archive в той же базе (миграция 8).
+ARCHIVE_TABLES = {
+    "tickets": ("id", "user_id", "username", "text", "status", "created_at", "assignee_id", "accepted_at", "done_at"),
+    "ticket_media": ("id", "ticket_id", "type", "file_id"),
+    "ticket_publications": ("id", "ticket_id", "chat_id", "message_id"),
+}
+
+ARCHIVE_SQLITE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS archive.tickets (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        username TEXT,
+        text TEXT,
+        status TEXT,
+        created_at TIMESTAMP,
+        assignee_id INTEGER,
+        accepted_at TIMESTAMP,
+        done_at TIMESTAMP
+    )""",
+    "CREATE TABLE IF NOT EXISTS archive.ticket_media (id INTEGER PRIMARY KEY, ticket_id INTEGER, type TEXT, file_id TEXT)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_ticket_media_ticket ON ticket_media (ticket_id)",
+    """
+    CREATE TABLE IF NOT EXISTS archive.ticket_publications (
+        id INTEGER PRIMARY KEY, ticket_id INTEGER, chat_id INTEGER, message_id INTEGER
+    )""",
+    "CREATE INDEX IF NOT EXISTS archive.idx_ticket_publications_ticket ON ticket_publications (ticket_id)",
+]
+
+
+def _sla_timers(dialect: str) -> list:
+    """Миграция 10: дедлайны sla.SlaScheduler (accept — заявка ждёт принятия, stale — заявка в работе).
+
+    Пишутся в тех же транзакциях, что и статус; при старте читаются в кучу целиком.
+    Открытым на момент обновления заявкам сроки считаются от создания / принятия по
+    SLA_ACCEPT_MINUTES / SLA_STALE_HOURS, действующим при миграции: выключенное тогда
+    SLA старым заявкам сроков не заводит, просроченные срабатывают сразу после старта.
+    """
+    sqlite = dialect == "sqlite"
+    statements = [f"""
+        CREATE TABLE IF NOT EXISTS ticket_timers (
+            ticket_id {"INTEGER" if sqlite else "BIGINT"} NOT NULL,
+            kind TEXT NOT NULL,
+            due_at {"TIMESTAMP" if sqlite else "TIMESTAMP(0)"} NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (ticket_id, kind)
+        )"""]
+    # Заявки, принятые до миграции 5, времени принятия не знают — срок от создания
+    for kind, status, since, seconds in (
+        ("accept", "new", "created_at", SLA_ACCEPT_MINUTES * 60),
+        ("stale", "accepted", "COALESCE(accepted_at, created_at)", SLA_STALE_HOURS * 3600),
+    ):
+        if not seconds:
+            continue
+        due = f"datetime({since}, '+{int(seconds)} seconds')" if sqlite else f"{since} + interval '{int(seconds)} seconds'"
+        statements.append(f"""
+            INSERT INTO ticket_timers (ticket_id, kind, due_at)
+            SELECT id, '{kind}', {due} FROM tickets WHERE status = '{status}' AND {since} IS NOT NULL
+            ON CONFLICT DO NOTHING""")
+    return statements
+
+
+MIGRATIONS = [
+    (1, "base schema", {"postgres": POSTGRES_BASE_SCHEMA, "sqlite": [
+        # Таблица пользователей
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            username TEXT,
+            role TEXT DEFAULT 'user'
+        )""",
+        # Таблица чатов поддержки
+        """
+        CREATE TABLE IF NOT EXISTS support_chats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER UNIQUE,
+            title TEXT,
+            is_active BOOLEAN DEFAULT 0,
+            approved_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        # Таблица тикетов
+        """
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            text TEXT,
+            status TEXT DEFAULT 'new',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        # Медиа тикетов
+        """
+        CREATE TABLE IF NOT EXISTS ticket_media (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id INTEGER,
+            type TEXT,
+            file_id TEXT
+        )""",
+        # Где и что опубликовано
+        """
+        CREATE TABLE IF NOT EXISTS ticket_publications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id INTEGER,
+            chat_id INTEGER,
+            message_id INTEGER
+        )""",
+        # Очередь публикаций: заявка сохранена, но ещё не разослана по чатам
+        """
+        CREATE TABLE IF NOT EXISTS pending_publications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id INTEGER UNIQUE,
+            attempts INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        # Логи
+        """
+        CREATE TABLE IF NOT EXISTS logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action TEXT,
+            user_id INTEGER,
+            details TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+    ]}),
+    (2, "secondary indexes", [
+        # /my_history: заявки пользователя по дате
+        "CREATE INDEX IF NOT EXISTS idx_tickets_user_created ON tickets (user_id, created_at)",
+        # Новые заявки для републикации
+        "CREATE INDEX IF NOT EXISTS idx_tickets_status_created ON tickets (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_ticket_media_ticket ON ticket_media (ticket_id)",
+        # В старых базах могли накопиться повторы — оставляем последнюю публикацию
+        """
+        DELETE FROM ticket_publications WHERE id NOT IN (
+            SELECT MAX(id) FROM ticket_publications GROUP BY ticket_id, chat_id
+        )""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_ticket_publications_ticket_chat ON ticket_publications (ticket_id, chat_id)",
+    ]),
+    (3, "keyset pagination of user history", [
+        "CREATE INDEX IF NOT EXISTS idx_tickets_user_id ON tickets (user_id, id)",
+    ]),
+    (4, "publication leases", [
+        # Экземпляр, взявший задание публикации, держит его до locked_until
+        "ALTER TABLE pending_publications ADD COLUMN locked_until TIMESTAMP",
+    ]),
+    (5, "ticket assignee", {
+        # Кто и когда принял заявку — пишется тем же UPDATE, что меняет статус
+        "sqlite": [
+            "ALTER TABLE tickets ADD COLUMN assignee_id INTEGER",
+            "ALTER TABLE tickets ADD COLUMN accepted_at TIMESTAMP",
+        ],
+        "postgres": [
+            "ALTER TABLE tickets ADD COLUMN assignee_id BIGINT",
+            "ALTER TABLE tickets ADD COLUMN accepted_at TIMESTAMP(0)",
+        ],
+    }),
+    (6, "full-text search", {
+        # FTS5 с внешним содержимым: индекс поверх tickets без копии текста,
+        # синхронизируется триггерами, существующие заявки — через rebuild
+        "sqlite": [
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS tickets_fts USING fts5(
+                text, username, content='tickets', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )""",
+            """
+            CREATE TRIGGER IF NOT EXISTS tickets_fts_ai AFTER INSERT ON tickets BEGIN
+                INSERT INTO tickets_fts (rowid, text, username) VALUES (new.id, new.text, new.username);
+            END""",
+            """
+            CREATE TRIGGER IF NOT EXISTS tickets_fts_ad AFTER DELETE ON tickets BEGIN
+                INSERT INTO tickets_fts (tickets_fts, rowid, text, username)
+                VALUES ('delete', old.id, old.text, old.username);
+            END""",
+            """
+            CREATE TRIGGER IF NOT EXISTS tickets_fts_au AFTER UPDATE OF text, username ON tickets BEGIN
+                INSERT INTO tickets_fts (tickets_fts, rowid, text, username)
+                VALUES ('delete', old.id, old.text, old.username);
+                INSERT INTO tickets_fts (rowid, text, username) VALUES (new.id, new.text, new.username);
+            END""",
+            "INSERT INTO tickets_fts (tickets_fts) VALUES ('rebuild')",
+        ],
+        # Индекс по выражению; db.search_tickets использует то же выражение TICKET_TSVECTOR
+        "postgres": [
+            f"CREATE INDEX IF NOT EXISTS idx_tickets_search ON tickets USING GIN ({TICKET_TSVECTOR})",
+        ],
+    }),
+    (7, "daily ticket statistics", {
+        # Агрегаты по дням (UTC) обновляются вместе с заявкой, /stats читает только их.
+        # Время до принятия/решения — в секундах; *_n — сколько событий с известным временем
+        # (у заявок до этой миграции его нет: они учтены в счётчиках, но не в средних)
+        "sqlite": [
+            "ALTER TABLE tickets ADD COLUMN done_at TIMESTAMP",
+            """
+            CREATE TABLE IF NOT EXISTS ticket_stats_daily (
+                day TEXT PRIMARY KEY,
+                created INTEGER NOT NULL DEFAULT 0,
+                accepted INTEGER NOT NULL DEFAULT 0,
+                resolved INTEGER NOT NULL DEFAULT 0,
+                accept_wait_sum REAL NOT NULL DEFAULT 0,
+                accept_wait_max REAL NOT NULL DEFAULT 0,
+                accept_wait_n INTEGER NOT NULL DEFAULT 0,
+                resolve_time_sum REAL NOT NULL DEFAULT 0,
+                resolve_time_max REAL NOT NULL DEFAULT 0,
+                resolve_time_n INTEGER NOT NULL DEFAULT 0
+            )""",
+            """
+            INSERT INTO ticket_stats_daily (day, created)
+            SELECT date(created_at), COUNT(*) FROM tickets WHERE created_at IS NOT NULL GROUP BY date(created_at)
+            """,
+            """
+            INSERT INTO ticket_stats_daily (day, accepted, accept_wait_sum, accept_wait_max, accept_wait_n)
+            SELECT date(COALESCE(accepted_at, created_at)), COUNT(*),
+                   COALESCE(SUM((julianday(accepted_at) - julianday(created_at)) * 86400), 0),
+                   COALESCE(MAX((julianday(accepted_at) - julianday(created_at)) * 86400), 0),
+                   COUNT(accepted_at)
+            FROM tickets WHERE status IN ('accepted', 'done') AND created_at IS NOT NULL
+            GROUP BY date(COALESCE(accepted_at, created_at))
+            ON CONFLICT(day) DO UPDATE SET
+                accepted = excluded.accepted, accept_wait_sum = excluded.accept_wait_sum,
+                accept_wait_max = excluded.accept_wait_max, accept_wait_n = excluded.accept_wait_n
+            """,
+            """
+            INSERT INTO ticket_stats_daily (day, resolved)
+            SELECT date(created_at), COUNT(*) FROM tickets WHERE status = 'done' AND created_at IS NOT NULL
+            GROUP BY date(created_at)
+            ON CONFLICT(day) DO UPDATE SET resolved = excluded.resolved
+            """,
+        ],
+        "postgres": [
+            "ALTER TABLE tickets ADD COLUMN done_at TIMESTAMP(0)",
+            """
+            CREATE TABLE IF NOT EXISTS ticket_stats_daily (
+                day TEXT PRIMARY KEY,
+                created INTEGER NOT NULL DEFAULT 0,
+                accepted INTEGER NOT NULL DEFAULT 0,
+                resolved INTEGER NOT NULL DEFAULT 0,
+                accept_wait_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+                accept_wait_max DOUBLE PRECISION NOT NULL DEFAULT 0,
+                accept_wait_n INTEGER NOT NULL DEFAULT 0,
+                resolve_time_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+                resolve_time_max DOUBLE PRECISION NOT NULL DEFAULT 0,
+                resolve_time_n INTEGER NOT NULL DEFAULT 0
+            )""",
+            """
+            INSERT INTO ticket_stats_daily (day, created)
+            SELECT to_char(created_at, 'YYYY-MM-DD'), COUNT(*) FROM tickets WHERE created_at IS NOT NULL
+            GROUP BY to_char(created_at, 'YYYY-MM-DD')
+            """,
+            """
+            INSERT INTO ticket_stats_daily (day, accepted, accept_wait_sum, accept_wait_max, accept_wait_n)
+            SELECT to_char(COALESCE(accepted_at, created_at), 'YYYY-MM-DD'), COUNT(*),
+                   COALESCE(SUM(EXTRACT(EPOCH FROM accepted_at - created_at)), 0),
+                   COALESCE(MAX(EXTRACT(EPOCH FROM accepted_at - created_at)), 0),
+                   COUNT(accepted_at)
+            FROM tickets WHERE status IN ('accepted', 'done') AND created_at IS NOT NULL
+            GROUP BY to_char(COALESCE(accepted_at, created_at), 'YYYY-MM-DD')
+            ON CONFLICT(day) DO UPDATE SET
+                accepted = excluded.accepted, accept_wait_sum = excluded.accept_wait_sum,
+                accept_wait_max = excluded.accept_wait_max, accept_wait_n = excluded.accept_wait_n
+            """,
+            """
+            INSERT INTO ticket_stats_daily (day, resolved)
+            SELECT to_char(created_at, 'YYYY-MM-DD'), COUNT(*) FROM tickets WHERE status = 'done' AND created_at IS NOT NULL
+            GROUP BY to_char(created_at, 'YYYY-MM-DD')
+            ON CONFLICT(day) DO UPDATE SET resolved = excluded.resolved
+            """,
+        ],
+    }),
+    (8, "ticket archive", {
+        # В SQLite архив — отдельный файл, см. ARCHIVE_SQLITE_SCHEMA
+        "sqlite": [],
+        "postgres": [
+            """
+            CREATE TABLE IF NOT EXISTS tickets_archive (
+                id BIGINT PRIMARY KEY,
+                user_id BIGINT,
+                username TEXT,
+                text TEXT,
+                status TEXT,
+                created_at TIMESTAMP(0),
+                assignee_id BIGINT,
+                accepted_at TIMESTAMP(0),
+                done_at TIMESTAMP(0)
+            )""",
+            "CREATE TABLE IF NOT EXISTS ticket_media_archive (id BIGINT PRIMARY KEY, ticket_id BIGINT, type TEXT, file_id TEXT)",
+            "CREATE INDEX IF NOT EXISTS idx_ticket_media_archive_ticket ON ticket_media_archive (ticket_id)",
+            """
+            CREATE TABLE IF NOT EXISTS ticket_publications_archive (
+                id BIGINT PRIMARY KEY, ticket_id BIGINT, chat_id BIGINT, message_id BIGINT
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_ticket_publications_archive_ticket ON ticket_publications_archive (ticket_id)",
+        ],
+    }),
+    (9, "support chat tags", [
+        # Теги чата для ROUTING_STRATEGY=tags: слова через пробел, в нижнем регистре
+        "ALTER TABLE support_chats ADD COLUMN tags TEXT",
+        # Заявки в работе по сотрудникам — нагрузка для routing.TicketRouter при старте
+        "CREATE INDEX IF NOT EXISTS idx_tickets_status_assignee ON tickets (status, assignee_id)",
+    ]),
+    (10, "SLA timers", _sla_timers),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# Ключ pg_advisory_xact_lock: экземпляры, стартующие одновременно, мигрируют по очереди
+MIGRATION_LOCK_ID = 7_243_001
+
+
+async def _get_version(db, dialect: str) -> int:
+    sql = "SELECT COALESCE(MAX(version), 0) FROM schema_version" if dialect == "postgres" else "PRAGMA user_version"
+    async with db.execute(sql) as cur:
+        return (await cur.fetchone())[0]
+
+
+async def _set_version(db, dialect: str, version: int):
+    if dialect == "postgres":
+        await db.execute("DELETE FROM schema_version")
+        await db.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+    else:
+        # PRAGMA не поддерживает параметры; version — число из кода
+        await db.execute(f"PRAGMA user_version = {int(version)}")
+
+
+async def _lock(db, dialect: str):
+    if dialect == "postgres":
+        await db.execute("SELECT pg_advisory_xact_lock(?)", (MIGRATION_LOCK_ID,))
+
+
+async def migrate(db, dialect: str = "sqlite"):
+    """Доводит схему до SCHEMA_VERSION. db — соединение из storage (sqlite или postgres)."""
+    if dialect == "postgres":
+        await db.execute("BEGIN")
+        await _lock(db, dialect)
+        await db.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        await db.commit()
+    current = await _get_version(db, dialect)
+    for version, name, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        if callable(statements):
+            statements = statements(dialect)
+        elif isinstance(statements, dict):
+            statements = statements[dialect]
+        await db.execute("BEGIN")
+        try:
+            await _lock(db, dialect)
+            # Пока ждали блокировку, миграцию мог применить другой экземпляр
+            if await _get_version(db, dialect) >= version:
+                await db.rollback()
+                current = version
+                continue
+            logger.info(f"Applying migration {version}: {name}")
+            for sql in statements:
+                await db.execute(sql)
+            await _set_version(db, dialect, version)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        current = version
+    return current
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from aiogram import Bot
+from config import PUBLISH_WORKERS, PUBLISH_MAX_ATTEMPTS, PUBLISH_LEASE_SECONDS
+from db import (
+    get_ticket, get_ticket_media, get_ticket_publications, get_active_support_chats,
+    get_pending_publications, claim_pending_publication, get_pending_publication_lease,
+    release_pending_publications, bump_pending_publication, delete_pending_publication
+)
+from publisher import publish_ticket, author_link
+from routing import ticket_router
+
+logger = logging.getLogger(__name__)
+
+
+class PublishQueue:
+    """Фоновая очередь "опубликовать заявку X" с N воркерами.
+
+    Источник истины — таблица pending_publications: строка появляется вместе
+    с заявкой (db.create_ticket) и удаляется после рассылки. При старте
+    незавершённые задания поднимаются из БД, так что рестарт их не теряет.
+    Перед рассылкой задание берётся в аренду (claim_pending_publication) —
+    при нескольких экземплярах бота на одной базе заявку публикует один из них.
+    Занятое задание откладывается до конца чужой аренды; при остановке свои
+    аренды снимаются, а после падения задание ждёт истечения аренды.
+    Куда именно отправить заявку, решает routing.ticket_router. Если в какие-то
+    чаты заявка не ушла, задание остаётся в таблице и повторяется с паузой —
+    только для чатов, где копии ещё нет.
+    """
+
+    def __init__(self, bot: Bot, workers: int = PUBLISH_WORKERS):
+        self.bot = bot
+        self.workers = max(1, workers)
+        self._queue = asyncio.Queue()
+        self._tasks = []
+        self._claimed = set()
+        self._claim_failures = {}
+        self._timers = set()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    async def join(self):
+        """Ждёт, пока очередь опустеет (без учёта отложенных повторов)."""
+        await self._queue.join()
+
+    def submit(self, ticket_id: int, attempts: int = 0):
+        self._queue.put_nowait((ticket_id, attempts))
+
+    async def start(self):
+        pending = await get_pending_publications()
+        for ticket_id, attempts in pending:
+            self.submit(ticket_id, attempts)
+        if pending:
+            logger.info(f"Возобновлено публикаций из очереди: {len(pending)}")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        # Недоставленные задания остаются в pending_publications до следующего старта;
+        # аренда прерванных снимается, чтобы их сразу подхватил следующий старт или другой экземпляр
+        claimed = list(self._claimed)
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        self._claim_failures.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await release_pending_publications(claimed)
+
+    def _submit_later(self, delay: float, ticket_id: int, attempts: int):
+        def fire():
+            self._timers.discard(timer)
+            self.submit(ticket_id, attempts)
+        timer = asyncio.get_running_loop().call_later(delay, fire)
+        self._timers.add(timer)
+
+    async def _postpone(self, ticket_id: int, attempts: int):
+        """Задание в чужой аренде: повторить, когда она истечёт; снятое задание забывается.
+
+        Если аренда свободна или база не ответила, забрать задание помешал сбой БД —
+        повторы идут с экспоненциальной паузой (не дольше PUBLISH_LEASE_SECONDS).
+        """
+        lease = await get_pending_publication_lease(ticket_id)
+        if lease is not None and not lease[0]:
+            self._claim_failures.pop(ticket_id, None)
+            return
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        locked_until = lease[1] if lease is not None else None
+        if locked_until is not None and locked_until > now:
+            self._submit_later((locked_until - now).total_seconds() + 1, ticket_id, attempts)
+            return
+        failures = self._claim_failures.get(ticket_id, 0) + 1
+        self._claim_failures[ticket_id] = failures
+        delay = min(2 ** failures, PUBLISH_LEASE_SECONDS)
+        logger.warning(f"Задание публикации заявки #{ticket_id} не удалось взять ({failures} раз подряд), "
+                       f"повтор через {delay} с")
+        self._submit_later(delay, ticket_id, attempts)
+
+    async def _publish(self, ticket_id: int) -> list:
+        """Рассылает заявку; возвращает чаты, куда её отправить не удалось."""
+        ticket = await get_ticket(ticket_id)
+        if not ticket:
+            logger.warning(f"Заявка #{ticket_id} из очереди публикаций не найдена")
+            return []
+        if ticket[4] != 'new':
+            # Заявку уже приняли (в том числе назначением) — рассылать по чатам незачем
+            return []
+        media = await get_ticket_media(ticket_id)
+        if ticket_router.assigns and await ticket_router.assign(self.bot, ticket, media):
+            return []
+        chats = await get_active_support_chats()
+        targets = ticket_router.chats_for(ticket[3], [chat[0] for chat in chats])
+        # Повтор (или рестарт посреди рассылки) не дублирует уже сохранённые копии
+        published = {chat_id for chat_id, _ in await get_ticket_publications(ticket_id)}
+        targets = [chat_id for chat_id in targets if chat_id not in published]
+        if not targets:
+            return []
+        return await publish_ticket(self.bot, ticket_id, ticket[3], author_link(ticket[1], ticket[2]), media, targets)
+
+    async def _retry(self, ticket_id: int, attempts: int, reason):
+        attempts += 1
+        if attempts >= PUBLISH_MAX_ATTEMPTS:
+            logger.error(f"Публикация заявки #{ticket_id} не удалась {attempts} раз, снимаем: {reason}")
+            await delete_pending_publication(ticket_id)
+            return
+        logger.warning(f"Публикация заявки #{ticket_id} не удалась (попытка {attempts}): {reason}")
+        await bump_pending_publication(ticket_id)
+        # Экспоненциальная пауза перед повтором, воркер при этом свободен
+        self._submit_later(2 ** attempts, ticket_id, attempts)
+
+    async def _worker(self, n: int):
+        while True:
+            ticket_id, attempts = await self._queue.get()
+            claimed = False
+            try:
+                if not await claim_pending_publication(ticket_id, PUBLISH_LEASE_SECONDS):
+                    # Задание уже снято или его ведёт другой экземпляр (или прошлый запуск, упавший с арендой)
+                    await self._postpone(ticket_id, attempts)
+                    continue
+                claimed = True
+                self._claimed.add(ticket_id)
+                self._claim_failures.pop(ticket_id, None)
+                try:
+                    failed = await self._publish(ticket_id)
+                except Exception as e:
+                    await self._retry(ticket_id, attempts, e)
+                    continue
+                if failed:
+                    await self._retry(ticket_id, attempts, f"не отправлено в чаты {failed}")
+                else:
+                    await delete_pending_publication(ticket_id)
+            except Exception as e:
+                logger.error(f"Ошибка очереди публикаций (заявка #{ticket_id}): {e}")
+            finally:
+                if claimed:
+                    self._claimed.discard(ticket_id)
+                self._queue.task_done()
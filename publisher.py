@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from aiogram import Bot
+from aiogram.types import InputMediaPhoto, InputMediaVideo
+from config import PUBLISH_CONCURRENCY
+from db import register_publications
+from keyboards import gen_accept_kb, gen_done_kb
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram и повторы после 429 — в RateLimitMiddleware сессии бота;
+# здесь только ограничение числа одновременных отправок
+_semaphore = asyncio.Semaphore(PUBLISH_CONCURRENCY)
+
+
+def author_link(user_id, username):
+    if username:
+        return f"@{username}"
+    return f"<a href='tg://user?id={user_id}'>{user_id}</a>"
+
+def _normalize_media(media):
+    # Медиа приходят и как dict из хендлеров, и как (type, file_id) из БД
+    return [m if isinstance(m, dict) else {'type': m[0], 'file_id': m[1]} for m in media or []]
+
+async def _send(bot: Bot, chat_id: int, ticket_id: int, text: str, author: str, media: list, kb=None):
+    """Отправляет заявку в один чат, возвращает message_id сообщения с кнопкой (по умолчанию «Принять»)."""
+    kb = kb or gen_accept_kb(ticket_id)
+    caption = f"{text}\n{author}" if text else author
+    group = []
+    for m in media:
+        if m['type'] == 'photo':
+            group.append(InputMediaPhoto(media=m['file_id'], caption=(text or None) if not group else None))
+        elif m['type'] == 'video':
+            group.append(InputMediaVideo(media=m['file_id'], caption=(text or None) if not group else None))
+
+    if len(group) > 1:
+        # К альбому нельзя прикрепить inline-клавиатуру, поэтому кнопка идёт отдельной карточкой
+        msgs = await bot.send_media_group(chat_id=chat_id, media=group)
+        card = await bot.send_message(
+            chat_id, f"Заявка #{ticket_id}\n{author}",
+            reply_to_message_id=msgs[0].message_id,
+            reply_markup=kb
+        )
+        return card.message_id
+
+    first = media[0] if media else None
+    if first and first['type'] == 'photo':
+        msg = await bot.send_photo(chat_id, first['file_id'], caption=caption, reply_markup=kb)
+    elif first and first['type'] == 'video':
+        msg = await bot.send_video(chat_id, first['file_id'], caption=caption, reply_markup=kb)
+    elif first and first['type'] == 'audio':
+        msg = await bot.send_audio(chat_id, first['file_id'], caption=caption, reply_markup=kb)
+    else:
+        msg = await bot.send_message(chat_id, caption, reply_markup=kb)
+    return msg.message_id
+
+async def send_assignment(bot: Bot, staff_id: int, ticket_id: int, text: str, author: str, media) -> int:
+    """Заявка, назначенная сотруднику, — ему в личку с кнопкой «Завершить»; возвращает message_id."""
+    header = f"Вам назначена заявка #{ticket_id}"
+    return await _send(bot, staff_id, ticket_id, f"{header}\n{text}" if text else header, author,
+                       _normalize_media(media), kb=gen_done_kb(ticket_id))
+
+async def _send_bounded(bot: Bot, chat_id: int, ticket_id: int, text: str, author: str, media: list):
+    async with _semaphore:
+        return await _send(bot, chat_id, ticket_id, text, author, media)
+
+async def _publish_to_chats(bot: Bot, ticket_id: int, text: str, author: str, media, chat_ids) -> list:
+    media = _normalize_media(media)
+    chat_ids = list(chat_ids)
+    results = await asyncio.gather(
+        *(_send_bounded(bot, chat_id, ticket_id, text, author, media) for chat_id in chat_ids),
+        return_exceptions=True
+    )
+    publications = []
+    for chat_id, result in zip(chat_ids, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Не удалось опубликовать заявку #{ticket_id} в чат {chat_id}: {result}")
+        else:
+            publications.append((ticket_id, chat_id, result))
+    return publications
+
+async def publish_ticket(bot: Bot, ticket_id: int, text: str, author: str, media, chat_ids) -> list:
+    """Параллельно публикует заявку во все чаты, возвращает чаты, где копия не сохранилась.
+
+    Ошибка в одном чате не мешает остальным; публикации записываются одним батчем.
+    Если батч не записался, неудачными считаются все чаты.
+    """
+    chat_ids = list(chat_ids)
+    publications = await _publish_to_chats(bot, ticket_id, text, author, media, chat_ids)
+    if publications and not await register_publications(publications):
+        return chat_ids
+    sent = {chat_id for _, chat_id, _ in publications}
+    return [chat_id for chat_id in chat_ids if chat_id not in sent]
+
+async def publish_many(bot: Bot, jobs: list, on_progress=None, flush_every: int = 100) -> int:
+    """Массовая публикация: jobs — [(ticket_id, text, author, media, chat_ids), ...].
+
+    Заявки обрабатывают PUBLISH_CONCURRENCY воркеров, публикации пишутся в БД
+    пачками по flush_every. on_progress(sent, total) вызывается после каждой заявки.
+    """
+    total = sum(len(job[4]) for job in jobs)
+    buffer = []
+    state = {"done": 0, "sent": 0}
+    it = iter(jobs)
+
+    async def flush():
+        batch = buffer[:]
+        buffer.clear()
+        if batch:
+            await register_publications(batch)
+
+    async def worker():
+        for ticket_id, text, author, media, chat_ids in it:
+            publications = await _publish_to_chats(bot, ticket_id, text, author, media, chat_ids)
+            buffer.extend(publications)
+            state["done"] += len(chat_ids)
+            state["sent"] += len(publications)
+            if len(buffer) >= flush_every:
+                await flush()
+            if on_progress:
+                await on_progress(state["done"], total)
+
+    await asyncio.gather(*(worker() for _ in range(min(PUBLISH_CONCURRENCY, len(jobs)))))
+    await flush()
+    return state["sent"]
@@ -0,0 +1,96 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity.
+
+    Ожидающие с priority=True обслуживаются раньше обычных: пока есть хоть один
+    приоритетный, обычные токены не берут, сколько бы их ни стояло в очереди.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._priority_lock = asyncio.Lock()
+        self._priority_waiting = 0
+        self._priority_done = asyncio.Event()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    async def _take(self, tokens: float, yield_to_priority: bool):
+        while True:
+            if yield_to_priority and self._priority_waiting:
+                self._priority_done.clear()
+                await self._priority_done.wait()
+                continue
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    async def acquire(self, tokens: float = 1, priority: bool = False):
+        # Запрос больше ёмкости иначе ждал бы вечно
+        tokens = min(tokens, self.capacity)
+        if not priority:
+            async with self._lock:
+                await self._take(tokens, yield_to_priority=True)
+            return
+        self._priority_waiting += 1
+        try:
+            async with self._priority_lock:
+                await self._take(tokens, yield_to_priority=False)
+        finally:
+            self._priority_waiting -= 1
+            if not self._priority_waiting:
+                self._priority_done.set()
+
+
+class ChatRateLimiter:
+    """Глобальный bucket + отдельный bucket на каждый чат.
+
+    Лимиты Telegram: ~30 сообщений/с на бота, ~20 сообщений/мин в группу,
+    ~1 сообщение/с в личный чат. Bucket-ы чатов хранятся в LRU ограниченного размера.
+    """
+
+    def __init__(self, global_rate: float = 30, group_per_minute: float = 20,
+                 private_rate: float = 1, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.group_per_minute = group_per_minute
+        self.private_rate = private_rate
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательный id или @username — группа/канал
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self.group_per_minute / 60, self.group_per_minute)
+            else:
+                bucket = TokenBucket(self.private_rate, self.private_rate)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id: int, tokens: float = 1, priority: bool = False):
+        await self._chat_bucket(chat_id).acquire(tokens, priority)
+        await self.global_bucket.acquire(tokens, priority)
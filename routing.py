@@ -0,0 +1,150 @@
+import logging
+import re
+import time
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from config import ROUTING_STRATEGY, ROUTING_MAX_LOAD
+from db import get_staff_loads, get_chat_tags, set_ticket_accepted, register_publications, get_user_by_id, log
+from keyboards import gen_status_kb
+from publisher import send_assignment, author_link
+from sla import sla_scheduler
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+# Сколько секунд не назначать заявки сотруднику, которому не доходят сообщения в личку
+UNREACHABLE_COOLDOWN = 600
+
+
+def parse_tags(text: str) -> list:
+    """«#Принтер, 1С» -> ["принтер", "1с"]: слова в нижнем регистре без повторов."""
+    return list(dict.fromkeys(_WORD.findall((text or "").lower())))
+
+
+class TicketRouter:
+    """Кому отправить новую заявку (ROUTING_STRATEGY).
+
+    broadcast — во все активные чаты поддержки; tags — только в чаты, чьи теги
+    встречаются в тексте заявки (без совпадений — в чаты без тегов); round_robin /
+    least_loaded — заявка сразу назначается одному сотруднику и уходит ему в личку,
+    так что гонки за «Принять» нет. Нагрузка — число заявок в работе (accepted) на
+    сотрудника — хранится в памяти: собирается из БД при старте (load) и дальше
+    меняется вместе со статусами заявок (accepted/released).
+    """
+
+    def __init__(self, strategy: str = ROUTING_STRATEGY, max_load: int = ROUTING_MAX_LOAD):
+        self.strategy = strategy
+        self.max_load = max_load
+        self.loads = {}
+        self.chat_tags = {}
+        self._staff = []
+        self._next = 0
+        self._unreachable = {}
+
+    @property
+    def assigns(self) -> bool:
+        return self.strategy in ("round_robin", "least_loaded")
+
+    def stats(self) -> dict:
+        return {"staff": len(self._staff), "accepted": sum(self.loads.get(s, 0) for s in self._staff)}
+
+    async def load(self):
+        """Пересобирает список сотрудников, их нагрузку и теги чатов из БД."""
+        rows = await get_staff_loads()
+        self._staff = sorted(staff_id for staff_id, _ in rows)
+        self.loads = {staff_id: accepted for staff_id, accepted in rows}
+        self.chat_tags = {chat_id: set(parse_tags(tags)) for chat_id, tags in await get_chat_tags()}
+
+    def set_role(self, user_id: int, role: str):
+        if role in ("staff", "admin"):
+            if user_id not in self._staff:
+                self._staff.append(user_id)
+                self._staff.sort()
+                self.loads.setdefault(user_id, 0)
+        elif user_id in self._staff:
+            self._staff.remove(user_id)
+
+    def set_tags(self, chat_id: int, tags: list):
+        if tags:
+            self.chat_tags[chat_id] = set(tags)
+        else:
+            self.chat_tags.pop(chat_id, None)
+
+    def accepted(self, staff_id: int):
+        self.loads[staff_id] = self.loads.get(staff_id, 0) + 1
+
+    def released(self, staff_id: int):
+        if self.loads.get(staff_id):
+            self.loads[staff_id] -= 1
+
+    def candidates(self) -> list:
+        """Сотрудники в порядке попыток назначения; занятые до max_load пропускаются."""
+        n = len(self._staff)
+        if not n:
+            return []
+        start = self._next % n
+        order = self._staff[start:] + self._staff[:start]
+        if self._unreachable:
+            now = time.monotonic()
+            self._unreachable = {s: until for s, until in self._unreachable.items() if until > now}
+            order = [s for s in order if s not in self._unreachable]
+        if self.max_load:
+            order = [s for s in order if self.loads.get(s, 0) < self.max_load]
+        if self.strategy == "least_loaded":
+            # Сортировка устойчивая: при равной нагрузке — по кругу
+            order.sort(key=lambda s: self.loads.get(s, 0))
+        return order
+
+    def chats_for(self, text: str, chat_ids: list) -> list:
+        if self.strategy != "tags" or not self.chat_tags:
+            return chat_ids
+        words = set(parse_tags(text))
+        matched = [c for c in chat_ids if self.chat_tags.get(c, set()) & words]
+        if matched:
+            return matched
+        return [c for c in chat_ids if c not in self.chat_tags] or chat_ids
+
+    async def assign(self, bot: Bot, ticket, media) -> bool:
+        """Назначает новую заявку сотруднику и присылает её ему в личку.
+
+        False — назначить некому (нет сотрудников, все заняты или недоступны в личке):
+        заявку нужно разослать по чатам.
+        """
+        ticket_id, owner_id, username, text = ticket[:4]
+        for staff_id in self.candidates():
+            try:
+                message_id = await send_assignment(bot, staff_id, ticket_id, text, author_link(owner_id, username), media)
+            except TelegramAPIError as e:
+                # Сотрудник не начинал диалог с ботом или заблокировал его
+                logger.warning(f"Заявку #{ticket_id} не удалось отправить сотруднику {staff_id}: {e}")
+                self._unreachable[staff_id] = time.monotonic() + UNREACHABLE_COOLDOWN
+                continue
+            self._next = self._staff.index(staff_id) + 1 if staff_id in self._staff else self._next
+            if not await set_ticket_accepted(ticket_id, staff_id):
+                # Заявку успели принять иначе (например, после /republish_ticket)
+                try:
+                    await bot.edit_message_reply_markup(
+                        chat_id=staff_id, message_id=message_id, reply_markup=gen_status_kb("Уже принята")
+                    )
+                except TelegramAPIError as e:
+                    logger.info(f"Статус заявки #{ticket_id} у сотрудника {staff_id} не обновлён: {e}")
+                return True
+            self.accepted(staff_id)
+            sla_scheduler.ticket_accepted(ticket_id)
+            # Личка сотрудника — такая же копия заявки: статус в ней обновит StatusSync
+            await register_publications([(ticket_id, staff_id, message_id)])
+            await log("assign", staff_id, f"Назначена заявка #{ticket_id} ({self.strategy})")
+            staff = await get_user_by_id(staff_id)
+            try:
+                await bot.send_message(
+                    owner_id,
+                    f"Ваша заявка #{ticket_id} взята в работу сотрудником поддержки.\n"
+                    f"{author_link(staff_id, staff[2] if staff else None)} займётся вашим вопросом!"
+                )
+            except TelegramAPIError as e:
+                logger.error(f"Не удалось уведомить пользователя {owner_id} о назначении заявки #{ticket_id}: {e}")
+            return True
+        return False
+
+
+ticket_router = TicketRouter()
@@ -0,0 +1,228 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from config import SLA_ACCEPT_MINUTES, SLA_STALE_HOURS, SLA_MAX_REMINDERS, ADMIN_USER_IDS
+from db import (
+    iter_ticket_timers, get_ticket_timer, claim_ticket_timer, delete_ticket_timer,
+    get_ticket, get_ticket_media, get_ticket_publications, get_active_support_chats, log
+)
+from keyboards import gen_done_kb
+from publisher import publish_ticket, author_link
+from stats import format_duration
+
+logger = logging.getLogger(__name__)
+
+# Сколько сработавших таймеров обрабатывается одновременно (после простоя их может быть много)
+FIRE_CONCURRENCY = 8
+
+
+def _timestamp(value) -> float:
+    # due_at в базе — наивный UTC; SQLite отдаёт его строкой
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class SlaScheduler:
+    """SLA-таймеры заявок: напоминания и эскалация без опроса базы.
+
+    Дедлайны хранятся в ticket_timers (пишутся db.create_ticket / set_ticket_accepted /
+    set_ticket_done в тех же транзакциях, что и статус) и в памяти — в min-куче.
+    Одна задача спит до ближайшего дедлайна; таймер с более ранним сроком будит её через
+    Event. Куча собирается из БД один раз при старте, дальше её пополняют
+    ticket_created/ticket_accepted, а снятые таймеры удаляются лениво: запись кучи
+    действительна, только пока совпадает с _live. Сработавший таймер забирается в БД
+    compare-and-set-ом — при нескольких экземплярах бота напоминание шлёт один.
+    """
+
+    def __init__(self, accept_after: float = SLA_ACCEPT_MINUTES * 60, stale_after: float = SLA_STALE_HOURS * 3600,
+                 max_reminders: int = SLA_MAX_REMINDERS):
+        self.after = {"accept": accept_after, "stale": stale_after}
+        self.max_reminders = max(1, max_reminders)
+        self.bot = None
+        self.fired = 0
+        self.escalated = 0
+        self._heap = []
+        self._live = {}
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(FIRE_CONCURRENCY)
+        self._fires = set()
+        self._task = None
+
+    def stats(self) -> dict:
+        return {"timers": len(self._live), "fired": self.fired, "escalated": self.escalated}
+
+    # --- куча ---
+
+    def _push(self, ticket_id: int, kind: str, due: float, attempts: int = 0):
+        if self._task is None:
+            # Планировщик не запущен (SLA выключено, скрипты) — таймеры остаются только в БД
+            return
+        self._live[(ticket_id, kind)] = (due, attempts)
+        heapq.heappush(self._heap, (due, ticket_id, kind, attempts))
+        if self._heap[0][0] == due:
+            self._wakeup.set()
+
+    def _cancel(self, ticket_id: int, kind: str):
+        if self._live.pop((ticket_id, kind), None) and len(self._heap) > 2 * len(self._live) + 1000:
+            # Снятых записей в куче больше половины — пересобираем её из живых
+            self._heap = [(due, t, k, a) for (t, k), (due, a) in self._live.items()]
+            heapq.heapify(self._heap)
+
+    def ticket_created(self, ticket_id: int):
+        if self.after["accept"]:
+            self._push(ticket_id, "accept", time.time() + self.after["accept"])
+
+    def ticket_accepted(self, ticket_id: int):
+        self._cancel(ticket_id, "accept")
+        if self.after["stale"]:
+            self._push(ticket_id, "stale", time.time() + self.after["stale"])
+
+    def ticket_done(self, ticket_id: int):
+        self._cancel(ticket_id, "accept")
+        self._cancel(ticket_id, "stale")
+
+    async def load(self):
+        self._heap, self._live = [], {}
+        async for rows in iter_ticket_timers():
+            for ticket_id, kind, due_at, attempts in rows:
+                due = _timestamp(due_at)
+                self._live[(ticket_id, kind)] = (due, attempts)
+                self._heap.append((due, ticket_id, kind, attempts))
+        heapq.heapify(self._heap)
+        if self._heap:
+            logger.info(f"SLA timers loaded: {len(self._heap)}")
+
+    # --- срабатывание ---
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            if self._heap and self._heap[0][0] <= now:
+                due, ticket_id, kind, attempts = heapq.heappop(self._heap)
+                if self._live.get((ticket_id, kind)) != (due, attempts):
+                    continue
+                del self._live[(ticket_id, kind)]
+                await self._semaphore.acquire()
+                task = asyncio.create_task(self._fire(ticket_id, kind, attempts))
+                self._fires.add(task)
+                task.add_done_callback(self._fired)
+                continue
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _fired(self, task):
+        self._fires.discard(task)
+        self._semaphore.release()
+
+    async def _fire(self, ticket_id: int, kind: str, attempts: int):
+        try:
+            await self._handle(ticket_id, kind, attempts)
+        except Exception as e:
+            logger.error(f"SLA-таймер {kind} заявки #{ticket_id} не обработан: {e}")
+
+    async def _handle(self, ticket_id: int, kind: str, attempts: int):
+        after = self.after[kind]
+        if not after:
+            # Этот вид напоминаний выключен после создания таймера
+            await delete_ticket_timer(ticket_id, kind)
+            return
+        reminder = attempts + 1
+        final = reminder >= self.max_reminders
+        next_due = None if final else datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0) + timedelta(seconds=after)
+        if not await claim_ticket_timer(ticket_id, kind, attempts, next_due):
+            # Таймер снят, перенесён или сработал в другом экземпляре — сверяемся с базой
+            row = await get_ticket_timer(ticket_id, kind)
+            if row:
+                self._push(ticket_id, kind, _timestamp(row[0]), row[1])
+            return
+        if next_due is not None:
+            self._push(ticket_id, kind, _timestamp(next_due), reminder)
+
+        ticket = await get_ticket(ticket_id)
+        if not ticket or ticket[4] != ("new" if kind == "accept" else "accepted"):
+            # Статус сменился в обход таймеров (или заявку удалили)
+            await delete_ticket_timer(ticket_id, kind)
+            self._cancel(ticket_id, kind)
+            return
+        self.fired += 1
+        if kind == "accept":
+            await self._remind_accept(ticket)
+        else:
+            await self._remind_stale(ticket)
+        if final:
+            self.escalated += 1
+            await self._escalate(ticket, kind, reminder)
+        await log("sla", ticket[6] if kind == "stale" else None, f"Напоминание {reminder} ({kind}) по заявке #{ticket_id}")
+
+    @staticmethod
+    def _age(since) -> str:
+        return format_duration(max(0.0, time.time() - _timestamp(since))) if since else "—"
+
+    async def _send(self, chat_id: int, text: str, **kwargs):
+        try:
+            await self.bot.send_message(chat_id, text, **kwargs)
+        except TelegramAPIError as e:
+            logger.warning(f"SLA-напоминание в чат {chat_id} не отправлено: {e}")
+
+    async def _remind_accept(self, ticket):
+        ticket_id = ticket[0]
+        chats = {chat[0] for chat in await get_active_support_chats()}
+        published = {chat_id: message_id for chat_id, message_id in await get_ticket_publications(ticket_id)}
+        # Эскалация: заявка уходит и в активные чаты, куда её не отправили (теги, новые чаты)
+        missing = [chat_id for chat_id in chats if chat_id not in published]
+        if missing:
+            media = await get_ticket_media(ticket_id)
+            await publish_ticket(self.bot, ticket_id, ticket[3], author_link(ticket[1], ticket[2]), media, missing)
+        text = f"⏰ Заявка #{ticket_id} ждёт принятия уже {self._age(ticket[5])}."
+        await asyncio.gather(*(
+            self._send(chat_id, text, reply_to_message_id=message_id, allow_sending_without_reply=True)
+            for chat_id, message_id in published.items() if chat_id in chats
+        ))
+
+    async def _remind_stale(self, ticket):
+        ticket_id, assignee_id = ticket[0], ticket[6]
+        if assignee_id:
+            await self._send(
+                assignee_id,
+                f"⏰ Заявка #{ticket_id} у вас в работе уже {self._age(ticket[7])}. "
+                "Если вопрос решён — завершите её.",
+                reply_markup=gen_done_kb(ticket_id)
+            )
+
+    async def _escalate(self, ticket, kind: str, reminders: int):
+        ticket_id = ticket[0]
+        if kind == "accept":
+            text = f"🚨 Заявку #{ticket_id} никто не принял за {self._age(ticket[5])} (напоминаний: {reminders})."
+        else:
+            text = (f"🚨 Заявка #{ticket_id} в работе у {author_link(ticket[6], None)} уже {self._age(ticket[7])} "
+                    f"и не завершена (напоминаний: {reminders}).")
+        await asyncio.gather(*(self._send(admin_id, f"{text}\nПодробнее: /ticket {ticket_id}") for admin_id in ADMIN_USER_IDS))
+
+    # --- запуск ---
+
+    async def start(self, bot: Bot):
+        if self._task is None and any(self.after.values()):
+            self.bot = bot
+            await self.load()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = list(self._fires)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+sla_scheduler = SlaScheduler()
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta, timezone
+from config import STATS_DAYS
+from db import get_ticket_stats, get_ticket_stats_days
+
+# /stats читает только агрегаты ticket_stats_daily: стоимость не зависит от числа заявок
+
+
+def format_duration(seconds) -> str:
+    if seconds is None:
+        return "—"
+    if seconds < 60:
+        return f"{seconds:.0f} с"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} мин"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} ч"
+    return f"{seconds / 86400:.1f} дн"
+
+def _avg(total, n):
+    return total / n if n else None
+
+async def stats_text(days: int = STATS_DAYS) -> str:
+    today = datetime.now(timezone.utc).date()
+    since = (today - timedelta(days=days - 1)).isoformat()
+    totals = await get_ticket_stats()
+    period = await get_ticket_stats(since)
+    rows = await get_ticket_stats_days(since)
+    if not totals or not totals[0]:
+        return "Статистики пока нет: заявок ещё не было."
+
+    created, accepted, resolved = totals[:3]
+    lines = [
+        "<b>📊 Статистика заявок</b>",
+        f"Всего: {created} · ждут принятия: {created - accepted} · в работе: {accepted - resolved} · закрыто: {resolved}",
+        "",
+        f"<b>За {days} дн.</b> (с {since}, UTC)",
+        f"Создано: {period[0]} · принято: {period[1]} · закрыто: {period[2]}",
+        f"До принятия: в среднем {format_duration(_avg(period[3], period[5]))}, максимум {format_duration(period[4] if period[5] else None)}",
+        f"До решения: в среднем {format_duration(_avg(period[6], period[8]))}, максимум {format_duration(period[7] if period[8] else None)}",
+    ]
+    if rows:
+        lines += ["", "<b>По дням</b> (создано / принято / закрыто · ср. до принятия / до решения)"]
+        for day, d_created, d_accepted, d_resolved, wait_sum, wait_n, resolve_sum, resolve_n in rows:
+            lines.append(
+                f"<code>{day}</code>  {d_created} / {d_accepted} / {d_resolved}"
+                f" · {format_duration(_avg(wait_sum, wait_n))} / {format_duration(_avg(resolve_sum, resolve_n))}"
+            )
+    return "\n".join(lines)
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from config import STATUS_SYNC_WORKERS
+from db import get_ticket_publications
+from keyboards import gen_status_kb
+
+logger = logging.getLogger(__name__)
+
+
+class StatusSync:
+    """Фоновая синхронизация статуса заявки во всех чатах, куда она опубликована.
+
+    submit() только запоминает последнее состояние заявки и ставит её в очередь:
+    повторные изменения, пришедшие до обработки, схлопываются в одно, а одну
+    заявку одновременно правит только один воркер — порядок состояний не путается.
+    Копии правятся параллельно; лимиты Telegram соблюдает RateLimitMiddleware сессии.
+    """
+
+    def __init__(self, bot: Bot, workers: int = STATUS_SYNC_WORKERS):
+        self.bot = bot
+        self.workers = max(1, workers)
+        self._queue = asyncio.Queue()
+        self._latest = {}
+        self._active = set()
+        self._tasks = []
+
+    def qsize(self) -> int:
+        return len(self._latest)
+
+    async def join(self):
+        await self._queue.join()
+
+    def submit(self, ticket_id: int, label: str, skip=None):
+        """label — текст статус-кнопки; skip — (chat_id, message_id), уже исправленное хендлером."""
+        queued = ticket_id in self._latest
+        self._latest[ticket_id] = (label, skip)
+        if not queued and ticket_id not in self._active:
+            self._queue.put_nowait(ticket_id)
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _edit(self, chat_id: int, message_id: int, label: str):
+        try:
+            await self.bot.edit_message_reply_markup(
+                chat_id=chat_id, message_id=message_id, reply_markup=gen_status_kb(label)
+            )
+        except TelegramBadRequest as e:
+            # Сообщение удалено или уже в нужном состоянии
+            logger.info(f"Статус в чате {chat_id} не обновлён: {e}")
+
+    async def _sync(self, ticket_id: int, label: str, skip):
+        publications = [p for p in await get_ticket_publications(ticket_id) if p != skip]
+        results = await asyncio.gather(
+            *(self._edit(chat_id, message_id, label) for chat_id, message_id in publications),
+            return_exceptions=True
+        )
+        for (chat_id, _), result in zip(publications, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Не удалось обновить статус заявки #{ticket_id} в чате {chat_id}: {result}")
+
+    async def _worker(self):
+        while True:
+            ticket_id = await self._queue.get()
+            self._active.add(ticket_id)
+            try:
+                label, skip = self._latest.pop(ticket_id)
+                await self._sync(ticket_id, label, skip)
+            except Exception as e:
+                logger.error(f"Синхронизация статуса заявки #{ticket_id} не удалась: {e}")
+            finally:
+                self._active.discard(ticket_id)
+                # Пока правили, статус успел смениться ещё раз
+                if ticket_id in self._latest:
+                    self._queue.put_nowait(ticket_id)
+                self._queue.task_done()
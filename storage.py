@@ -0,0 +1,307 @@
+"""Бэкенды хранилища под db.py.
+
+db.py пишет SQL в стиле SQLite (плейсхолдеры ?, db.execute/commit как у aiosqlite)
+и получает соединения через Storage.acquire(). SQLiteStorage — пул aiosqlite,
+PostgresStorage — пул asyncpg с тонким адаптером того же интерфейса, так что
+несколько экземпляров бота могут работать с одной базой.
+"""
+import asyncio
+import logging
+import re
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Время в базе — наивный UTC в формате CURRENT_TIMESTAMP, в SQLite хранится строкой
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(" ", "seconds"))
+sqlite3.register_adapter(date, lambda d: d.isoformat())
+
+
+class Storage(ABC):
+    """Интерфейс хранилища: пул соединений с API подмножества aiosqlite.Connection."""
+
+    dialect = None
+
+    @abstractmethod
+    async def open(self):
+        ...
+
+    @abstractmethod
+    async def close(self):
+        ...
+
+    @abstractmethod
+    def acquire(self):
+        """Асинхронный контекстный менеджер, выдающий соединение из пула."""
+
+    def stats(self) -> dict:
+        return {}
+
+
+# --- SQLite ---
+
+# PRAGMA, применяемые к каждому новому соединению
+SQLITE_PRAGMAS = (
+    # Действует только для новой базы (до создания таблиц): освобождённые архивацией
+    # страницы возвращаются ОС через PRAGMA incremental_vacuum
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout={busy_timeout}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+
+
+class SQLiteStorage(Storage):
+    """Пул долгоживущих соединений aiosqlite.
+
+    Соединения открываются лениво (не больше size штук) и переиспользуются
+    всеми функциями db.py, вместо connect/close на каждый запрос.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(self, path: str, size: int, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.size = max(1, size)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._idle = asyncio.LifoQueue()
+        self._opened = 0
+        self._lock = asyncio.Lock()
+        self._closed = False
+        self.acquired = 0
+
+    async def open(self):
+        pass
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.path)
+        for pragma in SQLITE_PRAGMAS:
+            await conn.execute(pragma.format(busy_timeout=self.busy_timeout_ms))
+        return conn
+
+    async def _get(self):
+        if self._closed:
+            raise RuntimeError("connection pool is closed")
+        self.acquired += 1
+        try:
+            return self._idle.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        async with self._lock:
+            if self._opened < self.size:
+                conn = await self._connect()
+                self._opened += 1
+                return conn
+        return await self._idle.get()
+
+    async def _put(self, conn):
+        if self._closed:
+            await conn.close()
+            self._opened -= 1
+            return
+        self._idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def acquire(self):
+        conn = await self._get()
+        try:
+            yield conn
+        finally:
+            # Незакоммиченная транзакция не должна достаться следующему владельцу
+            if conn.in_transaction:
+                try:
+                    await conn.rollback()
+                except Exception as e:
+                    logger.warning(f"pool rollback error: {e}")
+            await self._put(conn)
+
+    def stats(self) -> dict:
+        return {"size": self.size, "opened": self._opened, "idle": self._idle.qsize(), "acquired": self.acquired}
+
+    async def close(self):
+        self._closed = True
+        while not self._idle.empty():
+            conn = self._idle.get_nowait()
+            await conn.close()
+            self._opened -= 1
+
+
+# --- PostgreSQL ---
+
+def translate_placeholders(sql: str) -> str:
+    """? -> $1, $2, ... (вне строковых литералов)."""
+    out, n, quoted = [], 0, False
+    for ch in sql:
+        if ch == "'":
+            quoted = not quoted
+        if ch == "?" and not quoted:
+            n += 1
+            out.append(f"${n}")
+        else:
+            out.append(ch)
+    return "".join(out)
+
+
+class PgCursor:
+    def __init__(self, rows, rowcount: int):
+        self._rows = [tuple(r) for r in rows]
+        self._pos = 0
+        self.rowcount = rowcount
+        self.lastrowid = None  # в PostgreSQL — только через RETURNING
+
+    async def fetchone(self):
+        if self._pos >= len(self._rows):
+            return None
+        self._pos += 1
+        return self._rows[self._pos - 1]
+
+    async def fetchmany(self, size: int):
+        rows = self._rows[self._pos:self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+    async def fetchall(self):
+        rows = self._rows[self._pos:]
+        self._pos = len(self._rows)
+        return rows
+
+
+class _PgResult:
+    """Как у aiosqlite: результат execute() можно и await-ить, и использовать в async with."""
+
+    def __init__(self, coro):
+        self._coro = coro
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self):
+        return await self._coro
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+_RETURNS_ROWS = re.compile(r"^\s*(SELECT|WITH|VALUES|SHOW|EXPLAIN)\b|\bRETURNING\b", re.IGNORECASE)
+
+
+def _rowcount(status: str) -> int:
+    # "UPDATE 3", "INSERT 0 1", "DELETE 0", "SELECT 5"
+    try:
+        return int(status.rsplit(" ", 1)[-1])
+    except (ValueError, AttributeError):
+        return -1
+
+
+class PgConnection:
+    """Адаптер asyncpg под aiosqlite-подобный API db.py.
+
+    Как в sqlite3, транзакция открывается неявно первым запросом и живёт до
+    commit()/rollback(); при возврате в пул незакоммиченное откатывается.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._tx = None
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._tx is not None
+
+    async def _begin(self):
+        if self._tx is None:
+            self._tx = self._conn.transaction()
+            await self._tx.start()
+
+    async def _run(self, sql, params):
+        if sql.strip().upper() == "BEGIN":
+            await self._begin()
+            return PgCursor([], 0)
+        await self._begin()
+        # Через fetch/execute соединения, чтобы работал кэш подготовленных выражений asyncpg;
+        # rowcount для UPDATE/DELETE берётся из статуса execute, для запросов со строками — по их числу
+        query = translate_placeholders(sql)
+        if _RETURNS_ROWS.search(sql):
+            rows = await self._conn.fetch(query, *params)
+            return PgCursor(rows, len(rows))
+        return PgCursor([], _rowcount(await self._conn.execute(query, *params)))
+
+    def execute(self, sql: str, params=()):
+        return _PgResult(self._run(sql, params))
+
+    async def iterate(self, sql: str, params=(), batch_size: int = 1000):
+        """Серверный курсор: строки пачками по batch_size, результат целиком в память не грузится."""
+        await self._begin()
+        cursor = await self._conn.cursor(translate_placeholders(sql), *params)
+        while True:
+            rows = await cursor.fetch(batch_size)
+            if not rows:
+                return
+            yield [tuple(r) for r in rows]
+
+    async def executemany(self, sql: str, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        if not seq_of_params:
+            return
+        await self._begin()
+        await self._conn.executemany(translate_placeholders(sql), seq_of_params)
+
+    async def commit(self):
+        if self._tx is not None:
+            tx, self._tx = self._tx, None
+            await tx.commit()
+
+    async def rollback(self):
+        if self._tx is not None:
+            tx, self._tx = self._tx, None
+            await tx.rollback()
+
+
+class PostgresStorage(Storage):
+    dialect = "postgres"
+
+    def __init__(self, dsn: str, size: int):
+        self.dsn = dsn
+        self.size = max(1, size)
+        self._pool = None
+        self.acquired = 0
+
+    async def open(self):
+        import asyncpg  # опциональная зависимость, нужна только для STORAGE_BACKEND=postgres
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.size)
+
+    @asynccontextmanager
+    async def acquire(self):
+        self.acquired += 1
+        async with self._pool.acquire() as raw:
+            conn = PgConnection(raw)
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    await conn.rollback()
+
+    def stats(self) -> dict:
+        if self._pool is None:
+            return {}
+        return {"size": self.size, "opened": self._pool.get_size(),
+                "idle": self._pool.get_idle_size(), "acquired": self.acquired}
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+def create_storage(backend: str, database_path: str, database_url: str, size: int, busy_timeout_ms: int) -> Storage:
+    if backend == "postgres":
+        return PostgresStorage(database_url, size)
+    if backend != "sqlite":
+        raise RuntimeError(f"Unknown STORAGE_BACKEND: {backend}")
+    return SQLiteStorage(database_path, size, busy_timeout_ms)
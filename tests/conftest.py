@@ -0,0 +1,67 @@
+"""Общие фикстуры: каждый тест идёт на SQLite и на PostgreSQL через один интерфейс storage.py.
+
+PostgreSQL берётся из TEST_DATABASE_URL (например, postgresql://postgres@localhost/postgres);
+без неё варианты теста для postgres пропускаются. Каждому тесту — своя схема, удаляется после.
+"""
+import asyncio
+import os
+import sys
+import uuid
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "0:test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "")
+
+
+def _with_search_path(url: str, schema: str) -> str:
+    return url + ("&" if "?" in url else "?") + f"search_path={schema}"
+
+
+async def _pg_schema(schema: str, create: bool):
+    import asyncpg
+    conn = await asyncpg.connect(TEST_DATABASE_URL)
+    try:
+        if create:
+            await conn.execute(f"CREATE SCHEMA {schema}")
+        else:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    finally:
+        await conn.close()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def backend(request, tmp_path, monkeypatch):
+    """Цикл событий теста с настроенным бэкендом (sqlite или postgres); пул ещё не открыт."""
+    backend = request.param
+    schema = None
+    if backend == "postgres":
+        if not TEST_DATABASE_URL:
+            pytest.skip("TEST_DATABASE_URL не задан")
+        pytest.importorskip("asyncpg")
+        schema = f"helpdesk_test_{uuid.uuid4().hex[:12]}"
+        monkeypatch.setattr(db, "DATABASE_URL", _with_search_path(TEST_DATABASE_URL, schema))
+    monkeypatch.setattr(db, "STORAGE_BACKEND", backend)
+    monkeypatch.setattr(db, "ARCHIVE_DATABASE_PATH", str(tmp_path / "archive.sqlite3"))
+
+    with asyncio.Runner() as runner:
+        if schema:
+            runner.run(_pg_schema(schema, create=True))
+        try:
+            yield runner
+        finally:
+            runner.run(db.close_pool())
+            db.role_cache.clear()
+            if schema:
+                runner.run(_pg_schema(schema, create=False))
+
+
+@pytest.fixture
+def run(backend, tmp_path):
+    """Выполняет корутину в цикле событий теста, где открыт пул и применены миграции."""
+    backend.run(db.open_pool(str(tmp_path / "test.sqlite3"), 4))
+    backend.run(db.init_db())
+    return backend.run
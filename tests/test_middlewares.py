@@ -0,0 +1,108 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from middlewares import AlbumMiddleware, ThrottleMiddleware, ALBUM_MAX_ITEMS
+
+
+def _message(message_id, media_group_id=None, chat_id=1, chat_type="private", user_id=5):
+    async def answer(text, **kwargs):
+        message.answers.append(text)
+
+    message = SimpleNamespace(
+        message_id=message_id, media_group_id=media_group_id, answers=[], answer=answer,
+        chat=SimpleNamespace(id=chat_id, type=chat_type), from_user=SimpleNamespace(id=user_id),
+    )
+    return message
+
+
+class _Handler:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, event, data):
+        self.calls.append((event.message_id, [m.message_id for m in data.get("album", [])], time.monotonic()))
+        return event.message_id
+
+
+def test_album_grouping():
+    async def scenario():
+        middleware, handler = AlbumMiddleware(latency=0.05, max_wait=1), _Handler()
+        first = asyncio.create_task(middleware(handler, _message(1, "g"), {}))
+        await asyncio.sleep(0.01)
+        # Остальные элементы альбома поглощаются, порядок восстанавливается по message_id
+        assert await middleware(handler, _message(3, "g"), {}) is None
+        assert await middleware(handler, _message(2, "g"), {}) is None
+        assert await middleware(handler, _message(9), {}) == 9
+        assert await first == 1
+        return handler.calls
+
+    calls = asyncio.run(scenario())
+    assert [(event, album) for event, album, _ in calls] == [(9, []), (1, [1, 2, 3])]
+
+
+def test_album_max_wait():
+    async def scenario():
+        middleware, handler = AlbumMiddleware(latency=1, max_wait=0.1), _Handler()
+        started = time.monotonic()
+        await middleware(handler, _message(1, "g"), {})
+        return time.monotonic() - started
+
+    # Альбом не держится дольше max_wait, даже если latency больше
+    assert 0.1 <= asyncio.run(scenario()) < 0.5
+
+
+def test_album_max_items():
+    async def scenario():
+        middleware, handler = AlbumMiddleware(latency=0.05, max_wait=1), _Handler()
+        first = asyncio.create_task(middleware(handler, _message(1, "g"), {}))
+        await asyncio.sleep(0.01)
+        for message_id in range(2, 16):
+            assert await middleware(handler, _message(message_id, "g"), {}) is None
+        await first
+        return handler.calls
+
+    # Элементы сверх 10 отбрасываются
+    calls = asyncio.run(scenario())
+    assert [album for _, album, _ in calls] == [list(range(1, ALBUM_MAX_ITEMS + 1))]
+
+
+def test_album_overflow_flushes_oldest():
+    async def scenario():
+        middleware, handler = AlbumMiddleware(latency=0.2, max_wait=1, max_groups=1), _Handler()
+        started = time.monotonic()
+        first = asyncio.create_task(middleware(handler, _message(1, "a"), {}))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(middleware(handler, _message(2, "b", chat_id=2), {}))
+        await asyncio.gather(first, second)
+        return handler.calls, started
+
+    calls, started = asyncio.run(scenario())
+    # Первый альбом отдан досрочно, не дожидаясь latency
+    assert [event for event, _, _ in calls] == [1, 2]
+    assert calls[0][2] - started < 0.1
+    assert calls[1][2] - started >= 0.2
+
+
+def test_throttle_drops_and_warns_once():
+    async def scenario():
+        middleware, handler = ThrottleMiddleware(per_minute=600, burst=2), _Handler()
+        private = [_message(i) for i in range(4)]
+        results = [await middleware(handler, message, {}) for message in private]
+        # В группе лишнее сообщение тоже отбрасывается, но без предупреждения
+        group = _message(10, chat_id=-100, chat_type="supergroup", user_id=6)
+        for message_id in (11, 12):
+            await middleware(handler, _message(message_id, chat_id=-100, chat_type="supergroup", user_id=6), {})
+        await middleware(handler, group, {})
+        # После паузы токены восполняются, следующая серия снова предупреждается один раз
+        await asyncio.sleep(0.15)
+        later = [_message(20 + i) for i in range(3)]
+        after = [await middleware(handler, message, {}) for message in later]
+        return middleware, private, group, results, later, after
+
+    middleware, private, group, results, later, after = asyncio.run(scenario())
+    assert results == [0, 1, None, None]
+    assert [len(m.answers) for m in private] == [0, 0, 1, 0]
+    assert group.answers == []
+    assert after == [20, None, None]
+    assert [len(m.answers) for m in later] == [0, 1, 0]
+    assert middleware.stats() == {"passed": 5, "dropped": 5, "users": 2}
@@ -0,0 +1,83 @@
+from datetime import datetime
+import db
+import migrations
+from migrations import MIGRATIONS, SCHEMA_VERSION, _get_version
+
+
+async def _baseline(dialect: str):
+    """База как до версионированных миграций: только таблицы базовой схемы и немного данных."""
+    async with db.connection() as conn:
+        for sql in MIGRATIONS[0][2][dialect]:
+            await conn.execute(sql)
+        await conn.executemany(
+            "INSERT INTO tickets (user_id, username, text, status, created_at) VALUES (?, ?, ?, ?, ?)",
+            [
+                (10, "alice", "Не печатает принтер", "new", datetime(2024, 1, 10, 9)),
+                (11, "bob", "Сломалась мышь", "accepted", datetime(2024, 1, 10, 10)),
+                (12, "carol", "Нет сети", "done", datetime(2024, 1, 11, 11)),
+            ]
+        )
+        # Повторы публикаций, которые накапливались до уникального индекса
+        await conn.executemany(
+            "INSERT INTO ticket_publications (ticket_id, chat_id, message_id) VALUES (?, ?, ?)",
+            [(1, -100, 1), (1, -100, 2), (1, -200, 3), (2, -100, 4)]
+        )
+        await conn.execute("INSERT INTO pending_publications (ticket_id, attempts) VALUES (1, 2)")
+        await conn.commit()
+
+
+async def _fetchall(sql: str, params=()):
+    async with db.connection() as conn:
+        async with conn.execute(sql, params) as cur:
+            return [tuple(row) for row in await cur.fetchall()]
+
+
+def test_upgrade_from_baseline(backend, tmp_path, monkeypatch):
+    # SLA включено к моменту обновления — открытым заявкам заводятся сроки
+    monkeypatch.setattr(migrations, "SLA_ACCEPT_MINUTES", 30)
+    monkeypatch.setattr(migrations, "SLA_STALE_HOURS", 24)
+    run = backend.run
+    run(db.open_pool(str(tmp_path / "test.sqlite3"), 4))
+    run(_baseline(db.dialect()))
+    run(db.init_db())
+
+    async def version():
+        async with db.connection() as conn:
+            return await _get_version(conn, db.dialect())
+
+    assert run(version()) == SCHEMA_VERSION
+    # Миграция 2: от повторов остаётся последняя публикация в каждом чате
+    assert run(_fetchall("SELECT ticket_id, chat_id, message_id FROM ticket_publications ORDER BY id")) == [
+        (1, -100, 2), (1, -200, 3), (2, -100, 4)
+    ]
+    assert run(db.register_publications([(1, -200, 5)])) is True
+    assert sorted(tuple(p) for p in run(db.get_ticket_publications(1))) == [(-200, 5), (-100, 2)]
+    # Миграция 4: старое задание публикации без аренды сразу доступно
+    assert [tuple(p) for p in run(db.get_pending_publications())] == [(1, 2)]
+    assert run(db.claim_pending_publication(1, 300)) is True
+    # Миграция 7: счётчики восстановлены по старым заявкам, времени принятия у них нет
+    stats = run(db.get_ticket_stats())
+    assert stats[:3] == (3, 2, 1) and stats[5] == 0
+    assert [tuple(day[:4]) for day in run(db.get_ticket_stats_days("2024-01-01"))] == [
+        ("2024-01-11", 1, 1, 1), ("2024-01-10", 2, 1, 0)
+    ]
+    # Миграция 6: существующие заявки попали в полнотекстовый индекс
+    assert [row[0] for row in run(db.search_tickets("принтер"))[0]] == [1]
+    assert [row[0] for row in run(db.search_tickets("bob"))[0]] == [2]
+    # Новые заявки после миграций работают как обычно
+    ticket_id = run(db.create_ticket(13, "dave", "Не включается монитор", []))
+    assert [row[0] for row in run(db.search_tickets("монитор"))[0]] == [ticket_id]
+    # Миграция 10: сроки SLA для открытых заявок от создания (принятие до миграции 5 без времени)
+    assert run(_fetchall("SELECT ticket_id, kind, attempts FROM ticket_timers WHERE ticket_id < 4 ORDER BY ticket_id")) == [
+        (1, "accept", 0), (2, "stale", 0)
+    ]
+    assert str(run(db.get_ticket_timer(1, "accept"))[0]).startswith("2024-01-10 09:30:00")
+    assert str(run(db.get_ticket_timer(2, "stale"))[0]).startswith("2024-01-11 10:00:00")
+
+
+def test_upgrade_without_sla(backend, tmp_path):
+    run = backend.run
+    run(db.open_pool(str(tmp_path / "test.sqlite3"), 4))
+    run(_baseline(db.dialect()))
+    run(db.init_db())
+    assert run(_fetchall("SELECT ticket_id FROM ticket_timers")) == []
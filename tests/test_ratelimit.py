@@ -0,0 +1,47 @@
+import asyncio
+import time
+from ratelimit import TokenBucket, ChatRateLimiter
+
+
+def test_bucket_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=50, capacity=2)
+        assert bucket.try_acquire() and bucket.try_acquire()
+        assert not bucket.try_acquire()
+        started = time.monotonic()
+        await bucket.acquire()
+        await bucket.acquire()
+        return time.monotonic() - started
+
+    # Ёмкость исчерпана: два токена по 20 мс
+    assert 0.03 <= asyncio.run(scenario()) < 0.5
+
+
+def test_priority_goes_first():
+    async def scenario():
+        bucket = TokenBucket(rate=20, capacity=1)
+        assert bucket.try_acquire()
+        order = []
+
+        async def take(name, priority):
+            await bucket.acquire(priority=priority)
+            order.append(name)
+
+        # Обычные встали в очередь раньше, но приоритетные обслуживаются первыми
+        normal = [asyncio.create_task(take(f"n{i}", False)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        priority = [asyncio.create_task(take(f"p{i}", True)) for i in range(2)]
+        await asyncio.gather(*normal, *priority)
+        return order
+
+    assert asyncio.run(scenario()) == ["p0", "p1", "n0", "n1", "n2"]
+
+
+def test_chat_buckets():
+    limiter = ChatRateLimiter(global_rate=30, group_per_minute=20, private_rate=1, max_chats=2)
+    assert limiter._chat_bucket(-100).capacity == 20
+    assert limiter._chat_bucket(5).capacity == 1
+    # LRU: третий чат вытесняет самый давний
+    limiter._chat_bucket(-100)
+    limiter._chat_bucket(6)
+    assert list(limiter._chats) == [-100, 6]
@@ -0,0 +1,104 @@
+import asyncio
+import time
+import db
+import sla
+from sla import SlaScheduler
+
+
+class _Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def _scheduler(run, bot, **kwargs):
+    scheduler = SlaScheduler(**{"accept_after": 60, "stale_after": 3600, "max_reminders": 2, **kwargs})
+    run(scheduler.start(bot))
+    return scheduler
+
+
+def _ticket(run, monkeypatch):
+    monkeypatch.setattr(db, "SLA_ACCEPT_MINUTES", 1)
+    monkeypatch.setattr(db, "SLA_STALE_HOURS", 1)
+    run(db.add_support_chat(-100, "support"))
+    run(db.set_chat_active(-100, True, approved_by=1))
+    ticket_id = run(db.create_ticket(10, "alice", "Не печатает принтер", []))
+    run(db.register_publication(ticket_id, -100, 7))
+    return ticket_id
+
+
+def test_due_timer_fires_and_rearms(run, monkeypatch):
+    ticket_id = _ticket(run, monkeypatch)
+    bot = _Bot()
+    scheduler = _scheduler(run, bot)
+    assert scheduler.stats()["timers"] == 1
+
+    # Срок подошёл: напоминание в чат публикации, таймер переносится на следующий интервал
+    scheduler._push(ticket_id, "accept", time.time())
+    run(asyncio.sleep(0.2))
+    assert scheduler.fired == 1
+    assert [chat_id for chat_id, _ in bot.sent] == [-100]
+    due_at, attempts = run(db.get_ticket_timer(ticket_id, "accept"))
+    assert attempts == 1 and scheduler._live[(ticket_id, "accept")][1] == 1
+    run(scheduler.stop())
+
+
+def test_claim_is_compare_and_set(run, monkeypatch):
+    ticket_id = _ticket(run, monkeypatch)
+    bot = _Bot()
+    scheduler = _scheduler(run, bot)
+
+    run(scheduler._handle(ticket_id, "accept", 0))
+    assert scheduler.fired == 1
+    # Устаревшая запись кучи (таймер уже сработал в другом экземпляре) не шлёт повтор,
+    # а восстанавливает актуальный срок из базы
+    del scheduler._live[(ticket_id, "accept")]
+    run(scheduler._handle(ticket_id, "accept", 0))
+    assert scheduler.fired == 1 and len(bot.sent) == 1
+    assert scheduler._live[(ticket_id, "accept")][1] == 1
+
+    # Принятие снимает accept и заводит stale
+    run(db.set_ticket_accepted(ticket_id, 101))
+    scheduler.ticket_accepted(ticket_id)
+    assert (ticket_id, "accept") not in scheduler._live and (ticket_id, "stale") in scheduler._live
+    assert run(db.get_ticket_timer(ticket_id, "accept")) is None
+    run(scheduler._handle(ticket_id, "accept", 1))
+    assert scheduler.fired == 1
+    run(scheduler.stop())
+
+
+def test_escalation_after_max_reminders(run, monkeypatch):
+    monkeypatch.setattr(sla, "ADMIN_USER_IDS", [999])
+    ticket_id = _ticket(run, monkeypatch)
+    run(db.set_ticket_accepted(ticket_id, 101))
+    bot = _Bot()
+    scheduler = _scheduler(run, bot)
+
+    run(scheduler._handle(ticket_id, "stale", 0))
+    assert [chat_id for chat_id, _ in bot.sent] == [101] and scheduler.escalated == 0
+    # Последнее напоминание: исполнителю и администраторам, таймер удаляется
+    run(scheduler._handle(ticket_id, "stale", 1))
+    assert [chat_id for chat_id, _ in bot.sent] == [101, 101, 999]
+    assert "🚨" in bot.sent[-1][1] and scheduler.escalated == 1
+    assert run(db.get_ticket_timer(ticket_id, "stale")) is None
+    run(scheduler.stop())
+
+
+def test_status_changed_without_timers(run, monkeypatch):
+    ticket_id = _ticket(run, monkeypatch)
+    bot = _Bot()
+    scheduler = _scheduler(run, bot)
+
+    async def close_directly():
+        async with db.connection() as conn:
+            await conn.execute("UPDATE tickets SET status='done' WHERE id=?", (ticket_id,))
+            await conn.commit()
+
+    # Статус сменился в обход таймеров: напоминания нет, таймер удалён
+    run(close_directly())
+    run(scheduler._handle(ticket_id, "accept", 0))
+    assert scheduler.fired == 0 and bot.sent == []
+    assert run(db.get_ticket_timer(ticket_id, "accept")) is None
+    run(scheduler.stop())
@@ -0,0 +1,155 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+import db
+
+
+async def _collect(batches):
+    rows = []
+    async for batch in batches:
+        rows.extend(batch)
+    return rows
+
+
+async def _active_chat(chat_id: int):
+    await db.add_support_chat(chat_id, f"chat {chat_id}")
+    await db.set_chat_active(chat_id, True, approved_by=1)
+
+
+def test_create_ticket(run, monkeypatch):
+    # По умолчанию SLA выключено — таймеры не заводятся
+    assert run(db.get_ticket_timer(run(db.create_ticket(9, "eve", "text", [])), "accept")) is None
+    monkeypatch.setattr(db, "SLA_ACCEPT_MINUTES", 30)
+    media = [{'type': 'photo', 'file_id': 'p1'}, {'type': 'video', 'file_id': 'v1'}]
+    ticket_id = run(db.create_ticket(10, "alice", "Не печатает принтер", media))
+
+    ticket = run(db.get_ticket(ticket_id))
+    assert ticket[:5] == (ticket_id, 10, "alice", "Не печатает принтер", "new")
+    assert [tuple(m) for m in run(db.get_ticket_media(ticket_id))] == [("photo", "p1"), ("video", "v1")]
+    assert run(db.get_user_by_id(10))[2:4] == ("alice", "user")
+    # Задание публикации и SLA-таймер пишутся в той же транзакции
+    assert (ticket_id, 0) in [tuple(p) for p in run(db.get_pending_publications())]
+    assert run(db.get_ticket_timer(ticket_id, "accept")) is not None
+
+
+def test_accept_compare_and_set(run, monkeypatch):
+    monkeypatch.setattr(db, "SLA_ACCEPT_MINUTES", 30)
+    monkeypatch.setattr(db, "SLA_STALE_HOURS", 24)
+    ticket_id = run(db.create_ticket(10, "alice", "text", []))
+
+    async def race():
+        return await asyncio.gather(*(db.set_ticket_accepted(ticket_id, staff_id) for staff_id in (101, 102, 103, 104)))
+
+    results = run(race())
+    winners = [staff_id for staff_id, result in zip((101, 102, 103, 104), results) if result]
+    assert len(winners) == 1
+    assert tuple(results[(101, 102, 103, 104).index(winners[0])]) == (10, "text")
+    ticket = run(db.get_ticket(ticket_id))
+    assert ticket[4] == "accepted" and ticket[6] == winners[0]
+    # Принятую заявку повторно не забрать
+    assert run(db.set_ticket_accepted(ticket_id, 105)) is None
+    assert run(db.get_ticket_timer(ticket_id, "accept")) is None
+    assert run(db.get_ticket_timer(ticket_id, "stale")) is not None
+
+
+def test_done_is_idempotent(run):
+    ticket_id = run(db.create_ticket(10, "alice", "text", []))
+    # Непринятую заявку не закрыть: «в работе» в /stats не уходит в минус
+    assert run(db.set_ticket_done(ticket_id)) is False
+    assert run(db.get_ticket(ticket_id))[4] == "new" and run(db.get_ticket_stats())[:3] == (1, 0, 0)
+    run(db.set_ticket_accepted(ticket_id, 101))
+
+    assert run(db.set_ticket_done(ticket_id)) is True
+    done_at = run(db.get_ticket(ticket_id))[8]
+    assert run(db.set_ticket_done(ticket_id)) is False
+    ticket = run(db.get_ticket(ticket_id))
+    assert ticket[4] == "done" and ticket[8] == done_at
+    assert run(db.get_ticket_timer(ticket_id, "stale")) is None
+    assert run(db.get_ticket_stats())[:3] == (1, 1, 1)
+    assert run(db.set_ticket_done(999999)) is False
+
+
+def test_publication_dedupe(run):
+    run(_active_chat(-100))
+    run(_active_chat(-200))
+    ticket_id = run(db.create_ticket(10, "alice", "text", []))
+
+    assert run(db.register_publications([(ticket_id, -100, 1)])) is True
+    # Повторная публикация в тот же чат обновляет message_id, а не добавляет копию
+    assert run(db.register_publications([(ticket_id, -100, 2)])) is True
+    run(db.register_publication(ticket_id, -100, 3))
+    assert [tuple(p) for p in run(db.get_ticket_publications(ticket_id))] == [(-100, 3)]
+    assert run(db.is_ticket_published(ticket_id, -100)) is True
+    assert run(db.is_ticket_published(ticket_id, -200)) is False
+
+    unpublished = run(db.get_unpublished_new_tickets())
+    assert [(t[0], t[5]) for t in unpublished] == [(ticket_id, [-200])]
+
+
+def test_pending_publication_lease(run):
+    ticket_id = run(db.create_ticket(10, "alice", "text", []))
+
+    assert run(db.claim_pending_publication(ticket_id, 300)) is True
+    assert run(db.claim_pending_publication(ticket_id, 300)) is False
+    exists, locked_until = run(db.get_pending_publication_lease(ticket_id))
+    assert exists and locked_until > datetime.now(timezone.utc).replace(tzinfo=None)
+
+    # Снятая при остановке аренда сразу доступна следующему
+    run(db.release_pending_publications([ticket_id]))
+    assert run(db.get_pending_publication_lease(ticket_id)) == (True, None)
+    assert run(db.claim_pending_publication(ticket_id, 300)) is True
+
+    # Повтор после ошибки: попытка засчитана, аренда снята
+    run(db.bump_pending_publication(ticket_id))
+    assert [tuple(p) for p in run(db.get_pending_publications())] == [(ticket_id, 1)]
+    assert run(db.claim_pending_publication(ticket_id, 300)) is True
+
+    # Истёкшая аренда забирается заново
+    run(db.release_pending_publications([ticket_id]))
+    assert run(db.claim_pending_publication(ticket_id, -1)) is True
+    assert run(db.claim_pending_publication(ticket_id, 300)) is True
+
+    run(db.delete_pending_publication(ticket_id))
+    assert run(db.claim_pending_publication(ticket_id, 300)) is False
+    assert run(db.get_pending_publication_lease(ticket_id)) == (False, None)
+
+
+def test_search(run):
+    printer = run(db.create_ticket(10, "alice", "Не печатает принтер в бухгалтерии", []))
+    mouse = run(db.create_ticket(11, "bob", "Сломалась мышь", []))
+    both = run(db.create_ticket(12, "carol", "Принтер и мышь не работают", []))
+
+    rows, has_more = run(db.search_tickets("принтер"))
+    assert {row[0] for row in rows} == {printer, both} and not has_more
+    rows, _ = run(db.search_tickets("принтер мышь"))
+    assert [row[0] for row in rows] == [both]
+    # Поиск по префиксу и по username
+    assert [row[0] for row in run(db.search_tickets("бухгалт"))[0]] == [printer]
+    assert [row[0] for row in run(db.search_tickets("bob"))[0]] == [mouse]
+    assert run(db.search_tickets("клавиатура")) == ([], False)
+    assert run(db.search_tickets("   ")) == ([], False)
+
+    rows, has_more = run(db.search_tickets("принтер", limit=1))
+    assert len(rows) == 1 and has_more
+
+
+def test_export(run):
+    first = run(db.create_ticket(10, "alice", "one", [{'type': 'photo', 'file_id': 'p1'}]))
+    second = run(db.create_ticket(11, "bob", "two", []))
+    run(db.register_publications([(first, -100, 7)]))
+    run(db.set_ticket_accepted(second, 101))
+    run(db.set_ticket_done(second))
+    run(db.log("accept", 101, "Принял заявку"))
+
+    rows = run(_collect(db.iter_tickets_export(batch_size=1)))
+    assert [row[0] for row in rows] == [first, second]
+    assert json.loads(rows[0][9]) == [{"type": "photo", "file_id": "p1"}]
+    assert json.loads(rows[0][10]) == [{"chat_id": -100, "message_id": 7}]
+    assert json.loads(rows[1][9]) == [] and rows[1][4] == "done" and rows[1][6] == 101
+
+    assert [row[0] for row in run(_collect(db.iter_tickets_export(status="done")))] == [second]
+    tomorrow = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(days=1)
+    assert run(_collect(db.iter_tickets_export(since=tomorrow))) == []
+
+    logs = run(_collect(db.iter_logs_export()))
+    assert [(row[1], row[2], row[3]) for row in logs] == [("accept", 101, "Принял заявку")]
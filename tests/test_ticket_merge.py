@@ -0,0 +1,75 @@
+import asyncio
+import db
+from ticket_merge import TicketMerger
+
+
+class _Queue:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, ticket_id, attempts=0):
+        self.submitted.append(ticket_id)
+
+
+def _photos(n, prefix="p"):
+    return [{'type': 'photo', 'file_id': f"{prefix}{i}"} for i in range(n)]
+
+
+def test_messages_within_window_are_merged(run):
+    queue = _Queue()
+    merger = TicketMerger(queue, window=0.1)
+    first, merged = run(merger.submit(10, "alice", "Не печатает принтер", []))
+    assert not merged
+    assert run(merger.submit(10, "alice", "В бухгалтерии", _photos(2))) == (first, True)
+    # Другой автор — своя заявка
+    other, merged = run(merger.submit(11, "bob", "Сломалась мышь", []))
+    assert other != first and not merged
+    assert queue.submitted == []
+
+    # По истечении окна обе заявки уходят в очередь публикаций по одному разу
+    run(asyncio.sleep(0.2))
+    assert sorted(queue.submitted) == sorted([first, other])
+    assert run(db.get_ticket(first))[3] == "Не печатает принтер\nВ бухгалтерии"
+    assert [tuple(m) for m in run(db.get_ticket_media(first))] == [("photo", "p0"), ("photo", "p1")]
+    assert merger.stats() == {"open": 0, "merged": 1}
+
+    # После окна сообщение — уже новая заявка
+    third, merged = run(merger.submit(10, "alice", "И ещё сканер", []))
+    assert third not in (first, other) and not merged
+    run(merger.stop())
+
+
+def test_split_rules(run):
+    queue = _Queue()
+    merger = TicketMerger(queue, window=10)
+
+    # Подпись к медиа не длиннее 1024 символов: длинный текст начинает новую заявку,
+    # а открытая публикуется сразу
+    first, _ = run(merger.submit(10, "alice", "x" * 900, _photos(1)))
+    second, merged = run(merger.submit(10, "alice", "y" * 100, []))
+    assert second != first and not merged and queue.submitted == [first]
+
+    # Не больше 10 медиа в альбоме
+    assert run(merger.submit(10, "alice", "", _photos(8, "a"))) == (second, True)
+    third, merged = run(merger.submit(10, "alice", "", _photos(3, "b")))
+    assert third != second and not merged and queue.submitted == [first, second]
+
+    # Аудио не смешивается с фото
+    fourth, merged = run(merger.submit(10, "alice", "", [{'type': 'audio', 'file_id': 'au'}]))
+    assert fourth != third and not merged
+
+    # Принятую заявку не дописывают
+    run(db.set_ticket_accepted(fourth, 101))
+    fifth, merged = run(merger.submit(10, "alice", "ещё", []))
+    assert fifth != fourth and not merged
+    assert queue.submitted == [first, second, third, fourth]
+    assert run(db.get_ticket(fourth))[3] == ""
+    run(merger.stop())
+
+
+def test_without_window_publishes_immediately(run):
+    queue = _Queue()
+    merger = TicketMerger(queue, window=0)
+    first, _ = run(merger.submit(10, "alice", "one", []))
+    second, _ = run(merger.submit(10, "alice", "two", []))
+    assert first != second and queue.submitted == [first, second]
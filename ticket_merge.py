@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from config import TICKET_MERGE_WINDOW
+from db import create_ticket, append_ticket_message
+from publish_queue import PublishQueue
+from sla import sla_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Склеенная заявка должна остаться публикуемой: подпись к медиа — до 1024 символов,
+# текст — до 4096, в альбоме — до 10 элементов; запас под ссылку на автора
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+AUTHOR_RESERVE = 100
+MAX_MEDIA = 10
+
+
+class _OpenTicket:
+    __slots__ = ("ticket_id", "text_len", "media", "has_audio", "lock", "closed", "timer")
+
+    def __init__(self, ticket_id: int, text: str, media: list):
+        self.ticket_id = ticket_id
+        self.text_len = len(text)
+        self.media = len(media)
+        self.has_audio = any(m['type'] == 'audio' for m in media)
+        self.lock = asyncio.Lock()
+        self.closed = False
+        self.timer = None
+
+
+class TicketMerger:
+    """Склейка подряд идущих сообщений пользователя в одну заявку.
+
+    При window > 0 новая заявка уходит в очередь публикаций не сразу, а через window
+    секунд; сообщения автора, пришедшие до этого, дописываются в неё
+    (db.append_ticket_message), так что серия сообщений рассылается по чатам
+    поддержки одной заявкой. Если дописать нельзя (заявку уже приняли или
+    опубликовали, текст не влезет в подпись, альбом переполнен), открытая заявка
+    публикуется сразу, а сообщение становится новой заявкой. Задание публикации
+    лежит в pending_publications с момента создания — рестарт внутри окна его не
+    теряет, заявка просто публикуется при старте.
+    """
+
+    def __init__(self, publish_queue: PublishQueue, window: float = TICKET_MERGE_WINDOW):
+        self.publish_queue = publish_queue
+        self.window = window
+        self.merged = 0
+        self._open = {}
+        self._tasks = set()
+
+    def stats(self) -> dict:
+        return {"open": len(self._open), "merged": self.merged}
+
+    @staticmethod
+    def _fits(current: _OpenTicket, text: str, media: list) -> bool:
+        if media and (current.has_audio or any(m['type'] == 'audio' for m in media)):
+            # Аудио публикуется отдельным сообщением и с альбомом не складывается
+            return False
+        count = current.media + len(media)
+        limit = CAPTION_LIMIT if count else MESSAGE_LIMIT
+        return count <= MAX_MEDIA and current.text_len + 1 + len(text) <= limit - AUTHOR_RESERVE
+
+    async def submit(self, user_id: int, username: str, text: str, media: list):
+        """Сохраняет сообщение; возвращает (ticket_id, merged), ticket_id None — сохранить не удалось."""
+        if self.window <= 0:
+            ticket_id = await create_ticket(user_id, username, text, media)
+            if ticket_id:
+                sla_scheduler.ticket_created(ticket_id)
+                self.publish_queue.submit(ticket_id)
+            return ticket_id, False
+
+        current = self._open.get(user_id)
+        if current is not None:
+            if self._fits(current, text, media):
+                async with current.lock:
+                    if not current.closed and await append_ticket_message(current.ticket_id, text, media):
+                        current.text_len += (1 + len(text)) if text else 0
+                        current.media += len(media)
+                        self.merged += 1
+                        return current.ticket_id, True
+            await self._close(user_id, current)
+
+        ticket_id = await create_ticket(user_id, username, text, media)
+        if not ticket_id:
+            return None, False
+        sla_scheduler.ticket_created(ticket_id)
+        opened = _OpenTicket(ticket_id, text, media)
+        self._open[user_id] = opened
+        opened.timer = asyncio.get_running_loop().call_later(self.window, self._expire, user_id, opened)
+        return ticket_id, False
+
+    def _expire(self, user_id: int, opened: _OpenTicket):
+        task = asyncio.create_task(self._close(user_id, opened))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _close(self, user_id: int, opened: _OpenTicket):
+        # Под lock: дописывание, начатое до закрытия, успевает закоммититься до публикации
+        async with opened.lock:
+            if opened.closed:
+                return
+            opened.closed = True
+            opened.timer.cancel()
+            if self._open.get(user_id) is opened:
+                del self._open[user_id]
+            self.publish_queue.submit(opened.ticket_id)
+
+    async def stop(self):
+        # Неопубликованные заявки остаются в pending_publications до следующего старта
+        for opened in self._open.values():
+            opened.timer.cancel()
+        self._open.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)